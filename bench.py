@@ -0,0 +1,313 @@
+"""
+Benchmarks for the hot paths of the gin implementation.
+
+  python bench.py                       # run everything
+  python bench.py evaluate_discards     # run some benchmarks by name
+"""
+
+import argparse
+import itertools as it
+import random
+import time
+
+import cards
+import gin
+
+benchmarks = {}
+
+def benchmark(function):
+  benchmarks[function.__name__] = function
+  return function
+
+def time_per_call(function, *, repeat=5, number=None):
+  """ Best-of-`repeat` time of one call to `function`, in seconds """
+  if number is None:
+    # aim for roughly 0.2s per repetition
+    number = 1
+    while True:
+      start = time.perf_counter()
+      for _ in range(number): function()
+      if time.perf_counter() - start > 0.2: break
+      number *= 2
+
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for _ in range(number): function()
+    best = min(best, time.perf_counter() - start)
+  return best / number
+
+def report(name, seconds):
+  print(f"  {name:<48} {seconds * 1e6:10.1f} µs")
+
+def random_deals(count, *sizes, seed=0):
+  """ `count` deals, each a tuple of disjoint random hands of the given sizes """
+  rng = random.Random(seed)
+  deck = sorted(cards.all_cards)
+  deals = []
+  for _ in range(count):
+    rng.shuffle(deck)
+    starts = [ sum(sizes[:i]) for i in range(len(sizes) + 1) ]
+    deals.append(tuple( set(deck[start:end]) for start, end in zip(starts, starts[1:]) ))
+  return deals
+
+@benchmark
+def evaluate_discards():
+  """ Deadwood after each possible discard from 11-card hands, with and without an opponent hand """
+  deals = random_deals(200, 11, 10)
+
+  def loop(their=False):
+    for hand, their_hand in deals:
+      their_hand = their_hand if their else None
+      { card: gin.points_leftover(hand - {card}, their_hand) for card in hand }
+
+  def single_pass(their=False):
+    for hand, their_hand in deals:
+      gin.evaluate_discards(hand, their_hand if their else None)
+
+  # Without the cache, to measure the work itself
+  cache_size = gin.arrangement_cache.max_size
+  gin.set_arrangement_cache_size(0)
+  try:
+    for their in [False, True]:
+      label = 'with opponent hand' if their else 'alone'
+      looped = time_per_call(lambda: loop(their)) / len(deals)
+      single = time_per_call(lambda: single_pass(their)) / len(deals)
+      report(f"loop of points_leftover, {label}", looped)
+      report(f"evaluate_discards, {label}", single)
+      print(f"  {'speedup':<48} {looped / single:10.1f} x")
+  finally:
+    gin.set_arrangement_cache_size(cache_size)
+
+@benchmark
+def can_end():
+  """ Whether random 10-card hands can go down, using the deadwood bounds versus arranging """
+  hands = [ cards.hand_to_mask(hand) for hand, in random_deals(1000, 10) ]
+
+  cache_size = gin.arrangement_cache.max_size
+  gin.set_arrangement_cache_size(0)
+  try:
+    arranged = time_per_call(lambda: [ gin.points_leftover_mask(hand) <= gin.MAX_POINTS_TO_GO_DOWN for hand in hands ])
+    bounded = time_per_call(lambda: [ gin.can_end_mask(hand) for hand in hands ])
+    report("arranging every hand", arranged / len(hands))
+    report("can_end_mask", bounded / len(hands))
+    print(f"  {'speedup':<48} {arranged / bounded:10.1f} x")
+  finally:
+    gin.set_arrangement_cache_size(cache_size)
+
+@benchmark
+def in_process_hand():
+  """ Whole hands between Python bots run in the server process, i.e. without the fifos """
+  from pathlib import Path
+  import tournament
+
+  for name1, name2 in [('random', 'random'), ('simple', 'simple')]:
+    bot1 = tournament.InProcessBot.load(name1, Path(f"bots/{name1}"))
+    bot2 = tournament.InProcessBot.load(name2, Path(f"bots/{name2}"))
+
+    def hand():
+      with bot1, bot2:
+        gin.play_hand(bot1, bot2)
+
+    report(f"{name1} vs {name2}", time_per_call(hand, repeat=3))
+
+@benchmark
+def bot_processes():
+  """ Whole hands between bot processes over fifos, with a fresh process every hand versus kept alive """
+  from pathlib import Path
+  import tournament
+
+  timings = {}
+  for keep_alive in [False, True]:
+    bot1 = tournament.GinBot('simple', Path('bots/simple/simple.sh'), keep_alive=keep_alive)
+    bot2 = tournament.GinBot('simple', Path('bots/simple/simple.sh'), keep_alive=keep_alive)
+    try:
+      # Not too many hands, since each spawns processes
+      timings[keep_alive] = time_per_call(lambda: tournament.play_one_hand(bot1, bot2), repeat=3, number=10)
+    finally:
+      bot1.shutdown()
+      bot2.shutdown()
+
+  report("fresh processes", timings[False])
+  report("kept alive", timings[True])
+  report("overhead saved per hand", timings[False] - timings[True])
+
+@benchmark
+def protocol_versions():
+  """ Whole hands between kept-alive bot processes, with the bots planning their discards (protocol v2) or not """
+  from pathlib import Path
+  import logging
+  import channels
+  import tournament
+  channels.logger.setLevel(logging.WARNING)
+
+  received = 0
+  recv = channels.Channel.recv
+  def counting_recv(channel):
+    nonlocal received
+    received += 1
+    return recv(channel)
+
+  for name1, name2 in [('random', 'simple'), ('simple', 'simple')]:
+    for v2 in [False, True]:
+      bot1 = tournament.GinBot(name1, Path(f"bots/{name1}/{name1}.sh"), v2=v2)
+      bot2 = tournament.GinBot(name2, Path(f"bots/{name2}/{name2}.sh"), v2=v2)
+      # The same hands each time, since some deals go on forever
+      seeds = it.cycle(range(30))
+      try:
+        # Start the processes first
+        tournament.play_one_hand(bot1, bot2, 'start')
+        per_hand = time_per_call(lambda: tournament.play_one_hand(bot1, bot2, str(next(seeds))), repeat=3, number=30)
+        received = 0
+        channels.Channel.recv = counting_recv
+        for seed in range(30):
+          tournament.play_one_hand(bot1, bot2, str(seed))
+      finally:
+        channels.Channel.recv = recv
+        bot1.shutdown()
+        bot2.shutdown()
+      report(f"{name1} vs {name2}, {'v2' if v2 else 'v1'}", per_hand)
+      print(f"  {'  messages from the bots per hand':<48} {received / 30:10.1f}")
+
+@benchmark
+def wire_formats():
+  """ Encoding and decoding every message of a hand, as text versus binary """
+  from pathlib import Path
+  import tournament
+  import wire
+
+  class Recording:
+    """ A player which notes what play_hand and the bot say to each other """
+    def __init__(self, player, recorded):
+      self.player = player
+      self.recorded = recorded
+    def send(self, desc, *args):
+      self.recorded.append(('message', (desc, *args)))
+      self.player.send(desc, *args)
+    def recv(self):
+      response = self.player.recv()
+      self.recorded.append(('response', response))
+      return response
+    def send_and_recv(self, *args):
+      self.send(*args)
+      return self.recv()
+
+  hands = []
+  for seed in range(20):
+    recorded = []
+    bot1 = tournament.InProcessBot.load('random', Path('bots/random'))
+    bot2 = tournament.InProcessBot.load('simple', Path('bots/simple'))
+    with bot1, bot2:
+      gin.play_hand(Recording(bot1, recorded), Recording(bot2, recorded), rng=random.Random(seed))
+    hands.append(recorded)
+
+  for name, wire_format in [('text', wire.TEXT), ('binary', wire.BINARY)]:
+    def round_trips():
+      for recorded in hands:
+        for kind, item in recorded:
+          if kind == 'message':
+            wire_format.decode_message(wire_format.encode_message(*item))
+          else:
+            wire_format.decode_response(wire_format.encode_response(item))
+
+    size = 0
+    for recorded in hands:
+      for kind, item in recorded:
+        encoded = wire_format.encode_message(*item) if kind == 'message' else wire_format.encode_response(item)
+        size += len(encoded.encode() if isinstance(encoded, str) else encoded)
+
+    report(f"{name}, per hand", time_per_call(round_trips) / len(hands))
+    print(f"  {f'{name}, bytes per hand':<48} {size / len(hands):10.1f}")
+
+def echo_round_trip(channel_kwargs, message, count):
+  """ Time `count` round trips of `message` with an echoing client in a thread, per round trip """
+  import tempfile
+  import threading
+  from channels import Channel
+
+  with tempfile.TemporaryDirectory() as directory:
+    server = Channel('bench server', id='bench', role=Channel.SERVER, directory=directory, **channel_kwargs)
+    client = Channel('bench client', id='bench', role=Channel.CLIENT, directory=directory, **channel_kwargs)
+    server.open()
+    client.open()
+
+    def echo():
+      for _ in range(count):
+        client.send(client.recv())
+
+    thread = threading.Thread(target=echo)
+    thread.start()
+    start = time.perf_counter()
+    for _ in range(count):
+      server.send(message)
+      server.recv()
+    elapsed = time.perf_counter() - start
+    thread.join()
+
+    client.close()
+    server.close()
+  return elapsed / count
+
+@benchmark
+def channel_framing():
+  """ Round trips over a fifo channel, padded chunks versus length-prefixed frames """
+  import logging
+  import channels
+  # Logging every message would swamp the difference
+  channels.logger.setLevel(logging.WARNING)
+
+  messages = {
+    'short': 'discard:HX;False',
+    'starting': 'starting:C2,C3,D4,D5,H6,H7,S8,S9,SX,SJ;you start',
+    'long': 'x' * 500,
+  }
+  for label, message in messages.items():
+    chunked = min( echo_round_trip({ 'framing': 'chunked' }, message, 2000) for _ in range(3) )
+    framed = min( echo_round_trip({ 'framing': 'framed' }, message, 2000) for _ in range(3) )
+    report(f"{label} message, chunked", chunked)
+    report(f"{label} message, framed", framed)
+
+@benchmark
+def channel_transports():
+  """ Messages per second echoed over a channel, fifos versus a Unix domain socket """
+  import logging
+  import channels
+  channels.logger.setLevel(logging.WARNING)
+
+  message = 'discard:HX;False'
+  for framing in ['chunked', 'framed']:
+    for transport in ['fifo', 'socket']:
+      round_trip = min( echo_round_trip({ 'framing': framing, 'transport': transport }, message, 2000) for _ in range(3) )
+      # Each round trip is two messages
+      print(f"  {f'{transport}, {framing}':<48} {2 / round_trip:10.0f} msg/s")
+
+@benchmark
+def lockstep_hands():
+  """ Hands of the greedy policy against itself, one at a time through play_hand versus in lock-step """
+  import simulate
+  policy = (simulate.greedy_draws, simulate.greedy_discards)
+  seeds = range(200)
+
+  def one_at_a_time():
+    for seed in seeds:
+      gin.play_hand(simulate.PolicyPlayer(*policy), simulate.PolicyPlayer(*policy), rng=random.Random(seed))
+
+  # Skip the seeds on which the policy never ends
+  results = simulate.play_hands(*policy, range(1000), max_turns=1000)
+  seeds = [ seed for seed in seeds if results[seed] != 0 ]
+
+  sequential = time_per_call(one_at_a_time, repeat=1) / len(seeds)
+  lockstep = time_per_call(lambda: simulate.play_hands(*policy, seeds), repeat=3) / len(seeds)
+  report("play_hand", sequential)
+  report("simulate.play_hands", lockstep)
+  print(f"  {'speedup':<48} {sequential / lockstep:10.1f} x")
+
+parser = argparse.ArgumentParser(description='Run benchmarks')
+parser.add_argument('names', nargs='*', help=f"benchmarks to run: {', '.join(benchmarks)}")
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+
+  for name in args.names or benchmarks:
+    print(f"{name}: {benchmarks[name].__doc__.strip()}")
+    benchmarks[name]()
@@ -1,2 +1,3 @@
 #!/bin/sh
-echo "To play as a human, open a new terminal and run bots/human/human_gin.py"
+echo "To play as a human, open a new terminal and run:"
+echo "  GIN_TRANSPORT=$GIN_TRANSPORT GIN_CHANNEL_DIR=$GIN_CHANNEL_DIR GIN_CHANNEL_ID=$GIN_CHANNEL_ID python3 bots/human/human_gin.py"
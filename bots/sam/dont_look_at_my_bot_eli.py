@@ -22,7 +22,7 @@ def decompose_history(history):
     their_hand = set()
     discard = []
     for draw_choice, discard_choice, do_end in history:
-        if draw_choice is 'discard' and is_their_turn:
+        if draw_choice == 'discard' and is_their_turn:
             their_hand |= {discard.pop()}
 
         discard.append(discard_choice)
@@ -43,7 +43,9 @@ def choose_draw(hand, history, derivables):
     top_discard = discard[-1]
 
     take_discard_value = gin.points_leftover(hand | {top_discard})
-    take_deck_value = sum(gin.points_leftover(hand | {card}) for card in deck) / len(deck)
+    hand_mask = cards.hand_to_mask(hand)
+    draws = [hand_mask | cards.card_mask(card) for card in deck]
+    take_deck_value = gin.points_leftover_batch(draws).mean()
 
     if take_deck_value < take_discard_value:
         logger.info('taking card from deck')
@@ -82,7 +84,7 @@ def choose_discard(hand, history, derivables):
     their_pairs = gin.get_pairs(their_deadwood)
     gives_them_meld = gin.extends_any_pair(their_pairs)
 
-    gives_them_pair = lambda card: any(gin.is_pair(card, c) for c in their_deadwood)
+    gives_them_pair = lambda card: any(gin.is_pair((card, c)) for c in their_deadwood)
 
     def score_discard_choice(card):
         score = 0
@@ -107,7 +109,7 @@ def choose_discard(hand, history, derivables):
 def should_end(hand, history, derivables):
     return gin.points_leftover(hand, derivables['other_hand']) < 4
 
-best_bot = client.make_bot(choose_draw, choose_discard, should_end)
+best_bot = lambda: client.make_bot(choose_draw, choose_discard, should_end)
 
 if __name__ == '__main__':
     client.play_bot(best_bot)
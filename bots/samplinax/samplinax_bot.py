@@ -13,65 +13,32 @@ import gin
 import cards
 
 
-def emulate_game(active_hand, latent_hand, discard, *, turn, depth=2, n=5):
+def emulate_game(state, *, us, depth=2, n=5):
   """
-  active_hand is hand of person whose turn it is; latent_hand is hand of the person not playing
-  return (move, score) where `move` is the best move to make and `score` is its score
+  Search `n` random moves deep into the game from `state`, in which we are player `us`.
+  Return the score of the game for us.
   """
 
-  if turn == 'ours':
-    our_hand, their_hand = active_hand, latent_hand
-  else:
-    our_hand, their_hand = latent_hand, active_hand
-
   if depth == 0:
     # Return heuristic
-    return gin.score_hand(our_hand, their_hand)
-
-  # possible moves, each as (discard_location, drawn_card, discard_card, do_end)
-  possible_moves = []
-
-  # draw from discard
-  if len(discard) > 0:
-    draw_choice = discard[-1]
-    for discard_choice in active_hand:
-      for do_end in [True, False]:
-        possible_moves.append( ('discard', draw_choice, discard_choice, do_end) )
-
-  # draw from deck
-  deck = cards.all_cards - active_hand - latent_hand - set(discard)
-  for draw_choice in deck:
-    for discard_choice in active_hand:
-      for do_end in [True, False]:
-        possible_moves.append( ('deck', draw_choice, discard_choice, do_end) )
+    return gin.score_hand_mask(state.hands[us], state.hands[1 - us])
 
   #= recur =#
 
   def recur(move):
-    draw_location, drawn_card, discard_card, do_end = move
-
-    nonlocal discard
-    if draw_location == 'discard':
-      discard = discard[:-1]
-    discard = discard + [discard_card]
-
-    if do_end:
-      return gin.score_hand(our_hand, their_hand)
-    else:
-      # swtich hands since other person is player
-      return emulate_game(
-        latent_hand,
-        active_hand | {drawn_card},
-        discard,
-        turn = { 'ours': 'theirs', 'theirs': 'ours' }[turn],
-        depth=depth - 1,
-        n=n,
-      )
-
-  sample = random.sample(possible_moves, n)
-  results = list(map(recur, sample))
-
-  if turn == 'ours':
+    state.apply(move)
+    try:
+      if state.ended:
+        score = state.score()
+        return score if us == 0 else -score
+      else:
+        return emulate_game(state, us=us, depth=depth - 1, n=n)
+    finally:
+      state.undo()
+
+  results = list(map(recur, state.sample_moves(n)))
+
+  if state.turn == us:
     return max(results)
   else:
     return min(results)
@@ -83,14 +50,14 @@ def sample_possible_their_hands(hand, derivables, *, n=5):
   known = derivables['other_hand']
 
   # possibly in the their person's hand
-  maybe = cards.all_cards - set(derivables['discard']) - known
+  maybe = cards.all_cards - set(derivables['discard']) - known - hand
 
   # how many are they missing?
   remaining_count = 10 - len(known)
 
   def generate_hand():
     # Generate a possible hand of theirs
-    remaining_cards = set(random.sample(maybe, remaining_count))
+    remaining_cards = set(random.sample(sorted(maybe), remaining_count))
     return known | remaining_cards
 
   for _ in range(n):
@@ -99,7 +66,14 @@ def sample_possible_their_hands(hand, derivables, *, n=5):
 def do_search(hand, derivables, *, turn):
   their_hand_sample = sample_possible_their_hands(hand, derivables)
   for their_hand in their_hand_sample:
-    yield emulate_game(hand, their_hand, derivables['discard'], turn=turn)
+    state = gin.GameState(
+      cards.hand_to_mask(hand),
+      cards.hand_to_mask(their_hand),
+      # a drawn card which we're searching from is still on the discard pile
+      [ card for card in derivables['discard'] if card not in hand ],
+      turn={ 'ours': 0, 'theirs': 1 }[turn],
+    )
+    yield emulate_game(state, us=0)
 
 def score_gamestate(hand, derivables, *, turn='theirs'):
   return min(do_search(hand, derivables, turn=turn))
@@ -141,7 +115,7 @@ def should_end(hand, history, derivables):
   """ choose whether or not to go down """
   assert False
 
-simple_bot = client.make_bot(choose_draw, choose_discard, should_end)
+simple_bot = lambda: client.make_bot(choose_draw, choose_discard, should_end)
 
 if __name__ == '__main__':
   client.play_bot(simple_bot)
@@ -25,18 +25,16 @@ def choose_discard(hand, history, derivables):
   """ choose which card to discard """
 
   their_hand = derivables['other_hand']
+  score_from_removing = gin.evaluate_discards(hand, their_hand)
 
-  def score_from_removing(discard_choice):
-    return gin.points_leftover(hand - {discard_choice}, their_hand)
-
-  return min(hand, key=score_from_removing)
+  return min(hand, key=score_from_removing.get)
 
 def should_end(hand, history, derivables):
   """ choose whether or not to go down """
 
   return True
 
-simple_bot = client.make_bot(choose_draw, choose_discard, should_end)
+simple_bot = lambda: client.make_bot(choose_draw, choose_discard, should_end)
 
 if __name__ == '__main__':
   client.play_bot(simple_bot)
@@ -1,64 +1,155 @@
 
-class Card:
-  def __init__(self, card):
-
-    suit = card[0]
-    rank = card[1:]
-
-    assert rank in 'AXJQKaxjqk' or int(rank) in range(1, 13 + 1)
-    assert suit in 'CDHScdhs'
-
-    suit = suit.upper()
+SUITS = 'CDHS'
 
-    ranks = { 'A': 1, 'X': 10, 'J': 11, 'Q': 12, 'K': 13 }
-    rank = ranks.get(rank.upper()) or int(rank)
-
-    self.suit = suit.upper()
-    self.rank = rank
+class Card:
+  """
+  One of the 52 playing cards.
+
+  Cards are interned: there is exactly one Card object per card, which
+  `Card(...)` returns however the card is spelled, so cards compare and
+  hash by identity and all of their attributes are computed up front.
+  """
+
+  __slots__ = ('suit', 'rank', 'index', 'value', 'sigil', 'pretty_rank', '_string', '_order')
+
+  # Interned cards, by card index and by every string they've been parsed from
+  _by_index = [None] * 52
+  _by_string = {}
+
+  def __new__(cls, card):
+    try:
+      return cls._by_string[card]
+    except KeyError:
+      pass
+
+    suit, rank = _parse_card(card)
+    index = 13 * SUITS.index(suit) + rank - 1
+
+    self = cls._by_index[index]
+    if self is None:
+      self = cls._by_index[index] = object.__new__(cls)
+      sigils = { 'C': '♣', 'D': '♦', 'H': '♥', 'S': '♠' }
+      pretty_ranks = { 1: 'A', 11: 'J', 12: 'Q', 13: 'K' }
+      for name, value in [
+        ('suit', suit),
+        ('rank', rank),
+        ('index', index),
+        # rank-value but face cards are 10
+        ('value', min(rank, 10)),
+        ('sigil', sigils[suit]),
+        ('pretty_rank', pretty_ranks.get(rank) or str(rank)),
+        ('_string', suit + (pretty_ranks.get(rank) or str(rank))),
+        # order by rank, then suit
+        ('_order', 4 * rank + SUITS.index(suit)),
+      ]:
+        object.__setattr__(self, name, value)
+
+    cls._by_string[card] = self
+    return self
+
+  def __setattr__(self, name, value):
+    raise AttributeError("Cards are immutable")
+
+  def __reduce__(self):
+    # unpickle to the interned card
+    return (Card, (self._string,))
 
   def __repr__(self):
-    return f"Card({repr(str(self))})"
-
-  @property
-  def sigil(self):
-    sigils = { 'C': '♣', 'D': '♦', 'H': '♥', 'S': '♠' }
-    return sigils[self.suit]
-
-  @property
-  def pretty_rank(self):
-    ranks = { 1: 'A', 11: 'J', 12: 'Q', 13: 'K' }
-    return ranks.get(self.rank) or str(self.rank)
+    return f"Card({repr(self._string)})"
 
   def __str__(self):
-    return f"{self.suit}{self.pretty_rank}"
+    return self._string
 
-  @property
-  def value(self):
-    # rank-value but face cards are 10
-    return min(self.rank, 10)
+  @classmethod
+  def from_index(cls, index):
+    """ The card with this index in the bitmask encoding; see `card_mask` """
+    return cls._by_index[index]
 
   def adjacent(self, other):
     """ Are the two cards of the same suit and one different in rank? """
     return self.suit == other.suit and abs(self.rank - other.rank) == 1
 
-  @property
-  def _tuple(self):
-    return (self.rank, self.suit)
+  def __eq__(self, other): return self is other or (isinstance(other, Card) and self.index == other.index)
+  def __ne__(self, other): return not self == other
+  def __lt__(self, other): return self._order <  other._order
+  def __le__(self, other): return self._order <= other._order
+  def __gt__(self, other): return self._order >  other._order
+  def __ge__(self, other): return self._order >= other._order
+
+  def __hash__(self): return self.index
+
+def _parse_card(card):
+  """ Parse a string like 'H10', 'hx' or 'SQ' into (suit, rank) """
 
-  def __eq__(self, other): return isinstance(other, Card) and self._tuple == other._tuple
-  def __ne__(self, other): return not isinstance(other, Card) or self._tuple != other._tuple
-  def __lt__(self, other): return self._tuple <  other._tuple
-  def __le__(self, other): return self._tuple <= other._tuple
-  def __gt__(self, other): return self._tuple >  other._tuple
-  def __ge__(self, other): return self._tuple >= other._tuple
+  suit = card[0]
+  rank = card[1:]
 
-  def __hash__(self): return self._tuple.__hash__()
+  assert rank in 'AXJQKaxjqk' or int(rank) in range(1, 13 + 1)
+  assert suit in 'CDHScdhs'
+
+  ranks = { 'A': 1, 'X': 10, 'J': 11, 'Q': 12, 'K': 13 }
+  rank = ranks.get(rank.upper()) or int(rank)
+
+  return suit.upper(), rank
 
 
 all_cards = frozenset({ Card(f"{suit}{rank}")
                         for suit in 'cdhs'
                         for rank in range(1, 13 + 1) })
 
+#= bitmask encoding =#
+
+# A hand may be encoded as a 52-bit integer, where card `i` is in the hand
+# iff bit `i` is set. Cards are indexed suit-major, i.e. `13 * suit + rank - 1`,
+# so each suit owns a contiguous block of 13 rank bits (ace is the low bit).
+
+RANK_MASK = (1 << 13) - 1
+ALL_CARDS_MASK = (1 << 52) - 1
+
+cards_by_index = tuple(Card._by_index)
+
+def card_mask(card):
+  return 1 << card.index
+
+def suit_mask(mask, suit):
+  """ The 13-bit rank mask of the given suit (either an index or a letter) """
+  if isinstance(suit, str): suit = SUITS.index(suit.upper())
+  return (mask >> (13 * suit)) & RANK_MASK
+
+def suit_masks(mask):
+  """ The 13-bit rank masks of all four suits, in `SUITS` order """
+  return tuple((mask >> (13 * suit)) & RANK_MASK for suit in range(4))
+
+def mask_from_suit_masks(masks):
+  mask = 0
+  for suit, ranks in enumerate(masks):
+    mask |= ranks << (13 * suit)
+  return mask
+
+def mask_indices(mask):
+  """ yield the indices of the cards in the mask, lowest first """
+  while mask:
+    low = mask & -mask
+    yield low.bit_length() - 1
+    mask ^= low
+
+def hand_to_mask(cards):
+  mask = 0
+  for card in cards:
+    mask |= 1 << card.index
+  return mask
+
+def mask_to_hand(mask):
+  return { cards_by_index[i] for i in mask_indices(mask) }
+
+def mask_to_string(mask):
+  """ Wire format: cards joined with commas, e.g. 'C2,HX,SQ' """
+  return ','.join(str(cards_by_index[i]) for i in mask_indices(mask))
+
+def mask_from_string(string):
+  if string == '': return 0
+  return hand_to_mask(map(Card, string.split(',')))
+
 def parse_card_is_ok(string):
   try:
     Card(string)
@@ -2,6 +2,15 @@ import os
 import sys
 from pathlib import Path
 import subprocess
+import random
+import threading
+import itertools as it
+import stat
+import re
+import errno
+import struct
+import socket
+import asyncio
 
 import logging
 import logging.handlers
@@ -10,7 +19,7 @@ import traceback as tb
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-file_handler = logging.handlers.RotatingFileHandler('log.log', mode='w', maxBytes=1e5, backupCount=3)
+file_handler = logging.handlers.RotatingFileHandler('log.log', mode='w', maxBytes=1e5, backupCount=3, encoding='utf-8')
 formatter = logging.Formatter("%(name)s [%(levelname)s]: %(message)s")
 file_handler.setFormatter(formatter)
 file_handler.setLevel(logging.INFO)
@@ -29,9 +38,17 @@ sys.excepthook = exception_handler
 # == #
 
 def generate_random_string(*, length=35):
-  # TODO: ensure unique
+  # Not unique; ChannelRegistry makes ids that are
   return ''.join( str(random.randint(0, 9)) for _ in range(length) )
 
+def default_channel_dir():
+  """ Where channels' fifos go: GIN_CHANNEL_DIR, which the tournament sets for its bots, or /tmp/gin """
+  return Path(os.environ.get('GIN_CHANNEL_DIR', '/tmp/gin'))
+
+def default_transport():
+  """ How channels carry messages: GIN_TRANSPORT, which the tournament sets for its bots, or fifos """
+  return os.environ.get('GIN_TRANSPORT', Channel.FIFO)
+
 class Channel:
   """
   Two-way synchronous communication between processes.
@@ -61,18 +78,38 @@ class Channel:
     >>> channel.send('hello server')
     >>> channel.close()
 
+  Messages go over a pair of fifos, or over a Unix domain socket if the
+  transport is Channel.SOCKET. Both ends must use the same transport; by
+  default it's taken from GIN_TRANSPORT.
   """
 
   # Roles
   CLIENT = 'client'
   SERVER = 'server'
 
-  def __init__(self, name, *, id=None, role, chunk_size=50):
+  # Framings. Messages are either split into fixed-width chunks padded with
+  # spaces, or sent whole after a 4-byte length. Channels start out chunked,
+  # which every bot understands, and switch if both ends agree to.
+  # A framed channel can also carry bytes rather than strings, if `binary`.
+  CHUNKED = 'chunked'
+  FRAMED = 'framed'
+
+  # Transports
+  FIFO = 'fifo'
+  SOCKET = 'socket'
+
+  def __init__(self, name, *, id=None, role, chunk_size=50, directory=None, framing=CHUNKED, transport=None):
     self.name = name
 
     self.id = id or generate_random_string()
+    self.directory = Path(directory) if directory is not None else default_channel_dir()
     self.role = role
     self.chunk_size = chunk_size
+    self.framing = framing
+    self.binary = False
+    self.transport = transport or default_transport()
+    if self.transport not in [Channel.FIFO, Channel.SOCKET]:
+      raise ValueError(f"Unknown channel transport '{self.transport}'")
 
     logger.info(f"__init__ for channel {repr(self.name)} with id {repr(self.id)}.")
 
@@ -80,12 +117,7 @@ class Channel:
     logger.log(level, f"Channel {repr(self.name)}: {msg}")
 
   def _make_fifo(self, location):
-    if os.path.exists(location):
-      self._log("Fifo already exists; will override",
-                level=logging.WARNING)
-
-      os.remove(location)
-
+    # Raises FileExistsError if the fifo already exists, so ids can't be shared
     location.parent.mkdir(parents=True, exist_ok=True)
 
     # Uncomment if you wanna play with someone else on your system
@@ -96,65 +128,114 @@ class Channel:
   @property
   def _fifo_in_loc(self):
     if self.role == Channel.SERVER:
-      return Path(f"/tmp/gin/channel_to_server_{self.id}.fifo")
+      return self.directory / f"channel_to_server_{self.id}.fifo"
     elif self.role == Channel.CLIENT:
-      return Path(f"/tmp/gin/channel_to_client_{self.id}.fifo")
+      return self.directory / f"channel_to_client_{self.id}.fifo"
 
   @property
   def _fifo_out_loc(self):
     if self.role == Channel.SERVER:
-      return Path(f"/tmp/gin/channel_to_client_{self.id}.fifo")
+      return self.directory / f"channel_to_client_{self.id}.fifo"
     elif self.role == Channel.CLIENT:
-      return Path(f"/tmp/gin/channel_to_server_{self.id}.fifo")
+      return self.directory / f"channel_to_server_{self.id}.fifo"
 
   def _make_fifos(self):
     self._log("Making fifos")
     self._make_fifo(self._fifo_in_loc)
-    self._make_fifo(self._fifo_out_loc)
+    try:
+      self._make_fifo(self._fifo_out_loc)
+    except FileExistsError:
+      os.remove(self._fifo_in_loc)
+      raise
 
   def _remove_fifos(self):
     self._log("Destroying fifos")
     os.remove(self._fifo_in_loc)
     os.remove(self._fifo_out_loc)
 
+  @property
+  def _socket_loc(self):
+    return self.directory / f"channel_{self.id}.sock"
+
+  def _listen(self):
+    self._log("Listening")
+    self._socket_loc.parent.mkdir(parents=True, exist_ok=True)
+    self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      self.socket.bind(str(self._socket_loc))
+    except OSError as error:
+      self.socket.close()
+      if error.errno == errno.EADDRINUSE:
+        # Like a fifo that exists already
+        raise FileExistsError(f"Socket {self._socket_loc} already exists")
+      raise
+    self.socket.listen(1)
+
   def open(self):
     self._log("Opening")
 
+    self.socket = None
     if self.role == Channel.SERVER:
-      self._make_fifos()
+      if self.transport == Channel.SOCKET:
+        self._listen()
+      else:
+        self._make_fifos()
 
-    # Don't actually open the fifos yet.
+    # Don't actually open the fifos or connect yet.
     # The open() call will be blocking, so wait until the first send() or recv()
-    self.fifo_in = None
-    self.fifo_out = None
+    self.file_in = None
+    self.file_out = None
 
-    self._fifos_opened = False
+    self._files_opened = False
 
-  def _ensure_fifos_opened(self):
+  def _ensure_files_opened(self):
 
-    if not self._fifos_opened:
+    if not self._files_opened:
+
+      if self.transport == Channel.SOCKET:
+        if self.role == Channel.CLIENT:
+          self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+          self.socket.connect(str(self._socket_loc))
+          connection = self.socket
+        elif self.role == Channel.SERVER:
+          connection, _ = self.socket.accept()
+          # Only the one client, so stop listening
+          self.socket.close()
+          self.socket = connection
+        self.file_in = connection.makefile('rb')
+        self.file_out = connection.makefile('wb')
 
       # Reverse the open() order for client/server since we need them
       # to open the same file first
-      if self.role == Channel.CLIENT:
-        self.fifo_in = open(self._fifo_in_loc, 'r')
-        self.fifo_out = open(self._fifo_out_loc, 'w')
+      elif self.role == Channel.CLIENT:
+        self.file_in = open(self._fifo_in_loc, 'rb')
+        self.file_out = open(self._fifo_out_loc, 'wb')
 
       elif self.role == Channel.SERVER:
-        self.fifo_out = open(self._fifo_out_loc, 'w')
-        self.fifo_in = open(self._fifo_in_loc, 'r')
+        self.file_out = open(self._fifo_out_loc, 'wb')
+        self.file_in = open(self._fifo_in_loc, 'rb')
 
-      self._fifos_opened = True
+      self._files_opened = True
 
   def close(self):
     self._log("Closing")
 
-    if self._fifos_opened:
-      self.fifo_in.close()
-      self.fifo_out.close()
+    if self._files_opened:
+      self.file_in.close()
+      self.file_out.close()
+
+    if self.socket is not None:
+      self.socket.close()
+
+    self._remove_endpoint()
 
+  def _remove_endpoint(self):
     if self.role == Channel.SERVER:
-      self._remove_fifos()
+      if self.transport == Channel.SOCKET:
+        self._log("Removing socket")
+        os.remove(self._socket_loc)
+      else:
+        self._remove_fifos()
 
   def __enter__(self):
     self.open()
@@ -163,63 +244,293 @@ class Channel:
   def __exit__(self, exc_type, exc_value, traceback):
     self.close()
 
-  def send(self, message: str):
-    assert isinstance(message, str)
-    self._ensure_fifos_opened()
+  def send(self, message):
+    assert isinstance(message, bytes if self.binary else str)
+    self._ensure_files_opened()
 
     self._log(f"Delivering '{message}'")
+    self.file_out.write(self._encode(message))
+    self.file_out.flush()
 
-    for chunk, continues in chunk_string(message, self.chunk_size):
-      # If the message done, prepend and append a '!' a '!'; else, use a '+'
-      marker = '+' if continues else '!'
-      self.fifo_out.write(marker + (chunk + marker).ljust(self.chunk_size + 1))
+  def _encode(self, message):
+    """ The bytes which carry a message """
+    if self.framing == Channel.FRAMED:
+      payload = message if self.binary else message.encode()
+      return struct.pack('>I', len(payload)) + payload
 
-    self.fifo_out.flush()
+    assert not self.binary, "Only framed channels can be binary"
+
+    # Chunks are counted in bytes, so that a reader can read a fixed number
+    # of bytes per chunk whatever characters the message has
+    padded = []
+    for chunk, continues in chunk_string(message.encode(), self.chunk_size):
+      # If the message done, prepend and append a '!' a '!'; else, use a '+'
+      marker = b'+' if continues else b'!'
+      padded.append(marker + (chunk + marker).ljust(self.chunk_size + 1))
+    return b''.join(padded)
 
   def recv(self):
-    self._ensure_fifos_opened()
+    self._ensure_files_opened()
 
     self._log("Waiting")
 
-    chunks = []
-    while True:
-      read = self.fifo_in.read(self.chunk_size + 2).strip()
-
-      if read == '':
-        self._log("Empty read, meaning the other end of the channel crashed",
-                  level=logging.ERROR)
-        assert False, "Empty read"
+    if self.framing == Channel.FRAMED:
+      message = self._recv_framed()
+    else:
+      message = self._recv_chunked()
 
-      marker = read[0]
-      completed = { '!': True, '+': False }[marker]
+    self._log(f"Received '{message}'")
 
-      if completed:
-        i = read.rindex('!')
-        chunk = read[1:i]
-      else:
-        chunk = read[1:-1]
+    return message
 
+  def _empty_read(self):
+    self._log("Empty read, meaning the other end of the channel crashed",
+              level=logging.ERROR)
+    assert False, "Empty read"
+
+  def _recv_framed(self):
+    header = self.file_in.read(4)
+    if len(header) < 4:
+      self._empty_read()
+    length, = struct.unpack('>I', header)
+    payload = self.file_in.read(length)
+    if len(payload) < length:
+      self._empty_read()
+    return payload if self.binary else payload.decode()
+
+  def _recv_chunked(self):
+    chunks = []
+    while True:
+      chunk, completed = self._decode_chunk(self.file_in.read(self.chunk_size + 2))
       chunks.append(chunk)
-
       if completed:
         break
 
-    message = ''.join(chunks)
+    return b''.join(chunks).decode()
 
-    self._log(f"Received '{message}'")
+  def _decode_chunk(self, read):
+    """ A chunk's bytes, and whether it's the last of its message. A chunk
+    may end partway through a character, so chunks are decoded together. """
+    read = read.strip()
 
-    return message
+    if read == b'':
+      self._empty_read()
+
+    marker = read[:1]
+    completed = { b'!': True, b'+': False }[marker]
+
+    if completed:
+      i = read.rindex(b'!')
+      chunk = read[1:i]
+    else:
+      chunk = read[1:-1]
+
+    return chunk, completed
 
 def chunk_string(string, chunk_size):
-  """ yield `chunk_size` characters at a time and a boolean noting whether or not there's more to come.
+  """ yield `chunk_size` characters (or bytes) at a time and a boolean noting whether or not there's more to come.
   chunk_iter("12345678", 3) --> ("123", True), ("456", True), ("78", False) """
 
   while True:
     chunk = string[:chunk_size]
     string = string[chunk_size:]
 
-    continues = string != ''
+    continues = len(string) > 0
     yield (chunk, continues)
 
     if not continues:
       break
+
+#= asyncio =#
+
+class AsyncChannel(Channel):
+  """
+  A Channel whose `send` and `recv` are coroutines, so that one event loop
+  can talk over many channels at once. Either end of a channel may be async,
+  whatever the other end is.
+
+    >>> channel = AsyncChannel('my channel', id='test', role=Channel.SERVER)
+    >>> channel.open()
+    >>> await channel.send('hello client')
+    >>> await channel.recv()
+    'hello server'
+    >>> channel.close()
+  """
+
+  async def _ensure_files_opened(self):
+
+    if not self._files_opened:
+      loop = asyncio.get_event_loop()
+
+      if self.transport == Channel.SOCKET:
+        if self.role == Channel.CLIENT:
+          self.reader, self.writer = await asyncio.open_unix_connection(str(self._socket_loc))
+        elif self.role == Channel.SERVER:
+          self.socket.setblocking(False)
+          connection, _ = await loop.sock_accept(self.socket)
+          self.socket.close()
+          self.socket = None
+          self.reader, self.writer = await asyncio.open_unix_connection(sock=connection)
+        self._read_transport = None
+
+      else:
+        # Opening a fifo blocks until the other end opens it too, so do that in a thread
+        await _in_daemon_thread(super()._ensure_files_opened)
+
+        self.reader = asyncio.StreamReader()
+        self._read_transport, _ = await loop.connect_read_pipe(
+          lambda: asyncio.StreamReaderProtocol(self.reader), self.file_in)
+        # StreamReaderProtocol is the public protocol which lets a StreamWriter
+        # drain. Its reader goes unused, except to tell drain() the pipe closed
+        closed = asyncio.StreamReader()
+        write_transport, write_protocol = await loop.connect_write_pipe(
+          lambda: asyncio.StreamReaderProtocol(closed), self.file_out)
+        self.writer = asyncio.StreamWriter(write_transport, write_protocol, closed, loop)
+
+      self._files_opened = True
+
+  def close(self):
+    self._log("Closing")
+
+    if self._files_opened:
+      # Closing the transports closes the files, or the socket
+      self.writer.close()
+      if self._read_transport is not None:
+        self._read_transport.close()
+
+    if self.socket is not None:
+      self.socket.close()
+
+    self._remove_endpoint()
+
+  async def send(self, message):
+    assert isinstance(message, bytes if self.binary else str)
+    await self._ensure_files_opened()
+
+    self._log(f"Delivering '{message}'")
+    self.writer.write(self._encode(message))
+    await self.writer.drain()
+
+  async def recv(self):
+    await self._ensure_files_opened()
+
+    self._log("Waiting")
+
+    try:
+      if self.framing == Channel.FRAMED:
+        length, = struct.unpack('>I', await self.reader.readexactly(4))
+        message = await self.reader.readexactly(length)
+        if not self.binary:
+          message = message.decode()
+      else:
+        chunks = []
+        while True:
+          chunk, completed = self._decode_chunk(await self.reader.readexactly(self.chunk_size + 2))
+          chunks.append(chunk)
+          if completed:
+            break
+        message = b''.join(chunks).decode()
+    except asyncio.IncompleteReadError:
+      self._empty_read()
+
+    self._log(f"Received '{message}'")
+
+    return message
+
+def _in_daemon_thread(function):
+  """ A future for the result of `function` called in a daemon thread. Unlike
+  the loop's executor, the thread doesn't keep the process alive at exit if the
+  call never returns, as when a bot dies before opening its fifos. """
+  loop = asyncio.get_event_loop()
+  future = loop.create_future()
+
+  def settle(settle_future, value):
+    if not future.done():
+      settle_future(value)
+
+  def run():
+    try:
+      result = function()
+    except BaseException as error:
+      outcome = (future.set_exception, error)
+    else:
+      outcome = (future.set_result, result)
+    try:
+      loop.call_soon_threadsafe(settle, *outcome)
+    except RuntimeError:
+      # The loop's closed, and nobody's waiting
+      pass
+
+  threading.Thread(target=run, daemon=True).start()
+  return future
+
+#= registration =#
+
+class ChannelRegistry:
+  """
+  Hands out server channels with unique ids, for bots to connect to.
+  Channels use the default transport, so bots started with the same
+  GIN_TRANSPORT connect to them.
+
+  Ids start with the pid of the process which made them, so several threads
+  or processes can share a directory; creating the fifos fails if an id is
+  taken anyway, in which case another id is tried. On startup, fifos in the
+  directory left behind by processes that have died are removed.
+
+    >>> registry = ChannelRegistry('/tmp/gin/my-tournament')
+    >>> channel = registry.new_channel('server <-> bot')
+    >>> # start a bot with GIN_CHANNEL_DIR=registry.directory, GIN_CHANNEL_ID=channel.id
+  """
+
+  def __init__(self, directory=None):
+    self.directory = Path(directory) if directory is not None else default_channel_dir()
+    self.directory.mkdir(parents=True, exist_ok=True)
+    self._counter = it.count()
+    self._lock = threading.Lock()
+    remove_stale_fifos(self.directory)
+
+  def new_id(self):
+    with self._lock:
+      count = next(self._counter)
+    return f"{os.getpid()}-{count}-{random.getrandbits(32):08x}"
+
+  def new_channel(self, name, *, channel_class=Channel):
+    """ Make and open a server channel, a `channel_class`, with an unused id """
+    while True:
+      channel = channel_class(name, id=self.new_id(), role=Channel.SERVER, directory=self.directory)
+      try:
+        channel.open()
+      except FileExistsError:
+        logger.warning(f"Channel id {channel.id} is taken; trying another")
+        continue
+      return channel
+
+def _pid_is_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except (ProcessLookupError, OverflowError):
+    return False
+  except PermissionError:
+    pass
+  return True
+
+# The ids ChannelRegistry.new_id makes, starting with the pid
+REGISTRY_ID = re.compile(r'(\d+)-\d+-[0-9a-f]+')
+
+def remove_stale_fifos(directory):
+  """ Remove the channel fifos and sockets in the directory whose ids were made
+  by a ChannelRegistry in a process that's no longer alive. Other channels are
+  left alone, since there's no telling whether they're in use. """
+  paths = it.chain(Path(directory).glob('channel_to_*.fifo'), Path(directory).glob('channel_*.sock'))
+  for path in paths:
+    match = REGISTRY_ID.fullmatch(path.stem.split('_')[-1])
+    if match is None or _pid_is_alive(int(match.group(1))):
+      continue
+    try:
+      mode = path.stat().st_mode
+      if stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode):
+        logger.info(f"Removing stale fifo {path}")
+        path.unlink()
+    except FileNotFoundError:
+      pass
+
@@ -1,85 +1,308 @@
 """ Helper module for gin bots that are written in Python """
 
+import os
 import random
+import time
+import threading
+import collections
+import contextlib
+import queue
 
-from cards import Card
 import cards
 import gin
 from channels import Channel
+import wire
 
 def play_bot(bot):
   """ Accepts a bot and plays it against the server.
   The bot must be a generator which accepts and yields the
   proper values at the right times.
-  Just use the make_bot function to make it... """
+  Just use the make_bot function to make it...
+
+  The bot may instead be a function which makes such a generator, like
+  `lambda: make_bot(...)`. Then the process stays alive between hands,
+  and the server starts each hand with a fresh bot from the function.
+  It may also be a BatchBot from `make_batch_bot`, or its `bot` method;
+  then the decisions of the hands it plays at once are made in batches.
+
+  If the GIN_ARRANGEMENT_CACHE environment variable names a file, the
+  hand arrangement cache is warmed from it and saved back to it afterwards.
+  If GIN_SEED is set, `random` is seeded with it, so the bot plays the same
+  way each time. """
+
+  seed = os.environ.get('GIN_SEED')
+  if seed is not None:
+    random.seed(seed)
+
+  cache_path = os.environ.get('GIN_ARRANGEMENT_CACHE')
+  if cache_path:
+    gin.load_arrangement_cache(cache_path)
+
+  try:
+    _register_and_play(bot)
+  finally:
+    if cache_path:
+      gin.save_arrangement_cache(cache_path)
+
+def _register_and_play(bot):
+  """ Register with the server on the channel it made for us, and play """
+
+  # A BatchBot decides the hands it plays at once together; see play_multiplexed
+  batch_bot = getattr(bot, '__self__', bot)
+  if isinstance(batch_bot, BatchBot):
+    bot = batch_bot.bot
+  else:
+    batch_bot = None
+
+  new_bot = bot if callable(bot) else None
+
+  channel_id = os.environ.get('GIN_CHANNEL_ID')
+  if channel_id is None:
+    raise RuntimeError("GIN_CHANNEL_ID is not set; bots are meant to be started by the server.")
+
+  with Channel('client <-> server', id=channel_id, role=Channel.CLIENT) as channel:
+    # Offer length-prefixed binary messages, and to stay alive between hands
+    # and play many hands at once if we can
+    offered = ['framed', 'binary', 'v2'] + (['persistent', 'multiplexed'] if new_bot else [])
+    channel.send('register:' + ','.join(offered))
+    desc, capabilities = channel.recv().split(':', 1)
+    assert desc == 'registered', f"Expected to be registered, not '{desc}'"
+    accepted = capabilities.split(',')
+    if 'framed' in accepted:
+      channel.framing = Channel.FRAMED
+    wire_format = wire.TEXT
+    if 'binary' in accepted:
+      channel.binary = True
+      wire_format = wire.BINARY
+    v2 = 'v2' in accepted
+
+    if 'multiplexed' in accepted:
+      play_multiplexed(batch_bot or new_bot, channel, wire_format=wire_format, v2=v2)
+      return
+
+    if 'persistent' not in accepted:
+      play_bot_with_channels(new_bot() if new_bot else bot, channel, wire_format=wire_format, v2=v2)
+      return
 
-  with Channel('registration', id='gin_registration', role=Channel.CLIENT) as registration_channel:
-
-    random_str = ''.join( str(random.randint(0, 9)) for _ in range(20) )
-    id = random_str
-    registration_channel.send(id)
-
-    # wait for server to create fifos
-    response = registration_channel.recv()
-    assert response == 'fifos made'
+    while True:
+      play_bot_with_channels(new_bot(), channel, wire_format=wire_format, v2=v2)
 
-  with Channel('client <-> server', id=id, role=Channel.CLIENT) as channel:
-    play_bot_with_channels(bot, channel)
+      desc, *args = wire_format.decode_message(channel.recv())
+      if desc == 'quit':
+        break
+      assert desc == 'new_hand', f"Expected a new hand or to quit, not '{desc}'"
+      seed, = args
+      if seed:
+        random.seed(seed)
+
+def play_bot_with_channels(bot, channel, *, wire_format=wire.TEXT, v2=False):
+  """ Play a hand with the bot over the channel, with messages written in `wire_format` (see wire.py) """
+  hand = hand_messages(bot, v2=v2)
+  send = lambda response: channel.send(wire_format.encode_response(response))
+  playing = _advance(hand, None, send)
+  while playing:
+    playing = _advance(hand, wire_format.decode_message(channel.recv()), send)
+
+def play_multiplexed(new_bot, channel, *, wire_format=wire.TEXT, v2=False):
+  """
+  Play many hands at once over the channel, each with a fresh bot from
+  `new_bot`, until the server says to quit. Every message but 'quit' is
+  tagged with the id of its hand, like '3|drawn:H4', and each hand starts
+  with a 'new_hand' message. Each seeded hand has its own `random` state,
+  swapped in while its bot runs, so it plays the same however the hands
+  are interleaved.
+
+  `new_bot` may instead be a BatchBot. Then a hand waiting on a decision
+  doesn't hold up the others: messages for other hands are handled until
+  every hand is waiting on a decision or a message, and then the pending
+  decisions are made in one batch. A batch waits at most the BatchBot's
+  `max_wait` seconds for messages for the other hands.
+  """
+  batch_bot = new_bot if isinstance(new_bot, BatchBot) else None
+  if batch_bot is not None:
+    new_bot = batch_bot.deferring_bot
+    # Read in a thread, so that we can tell whether a message has come
+    inbox = _inbox(channel, wire_format)
+    recv = lambda timeout=None: inbox.get(timeout=timeout)
+  else:
+    recv = lambda timeout=None: channel.recv()
+
+  hands = {}
+  random_states = {}
+  # The decision each hand of a BatchBot is waiting on, if any
+  deciding = {}
+  # When the oldest of those began waiting
+  deciding_since = None
+
+  def advance(game, message):
+    nonlocal deciding_since
+    send = lambda response: channel.send(wire_format.tag(game, wire_format.encode_response(response)))
+    with _random_state(random_states, game):
+      playing = _advance(hands[game], message, send)
+
+    if not playing:
+      del hands[game]
+      random_states.pop(game, None)
+    elif isinstance(playing, _Decision):
+      if not deciding:
+        deciding_since = time.monotonic()
+      deciding[game] = playing
 
+  while True:
+    received = None
+    if deciding:
+      if len(deciding) < min(len(hands), batch_bot.batcher.max_batch_size):
+        try:
+          received = recv(timeout=max(0, deciding_since + batch_bot.batcher.max_wait - time.monotonic()))
+        except queue.Empty:
+          pass
+      if received is None:
+        games = list(deciding)
+        results = batch_bot.batcher.decide_now([ deciding.pop(game) for game in games ])
+        for game, result in zip(games, results):
+          advance(game, result)
+        continue
+    else:
+      received = recv()
+
+    if isinstance(received, BaseException):
+      raise received
+    game, message = wire_format.untag(received)
+    message = wire_format.decode_message(message)
+    if game is None:
+      assert message == ('quit',), f"Expected an untagged message to be to quit, not '{message[0]}'"
+      break
+    assert game not in deciding, f"Got a message for hand {game} while it was deciding"
+
+    if game not in hands:
+      desc, seed = message
+      assert desc == 'new_hand', f"Expected hand {game} to start with a new hand, not '{desc}'"
+      if seed:
+        random_states[game] = random.Random(seed).getstate()
+      hands[game] = hand_messages(new_bot(), v2=v2)
+      message = None
+
+    advance(game, message)
+
+def _inbox(channel, wire_format):
+  """ A queue of the messages received over a multiplexed channel, read by a
+  thread until it's told to quit. If receiving fails, the error is put instead. """
+  inbox = queue.Queue()
+
+  def receive():
+    try:
+      while True:
+        message = channel.recv()
+        inbox.put(message)
+        if wire_format.untag(message)[0] is None:
+          break
+    except BaseException as error:
+      inbox.put(error)
+
+  threading.Thread(target=receive, daemon=True).start()
+  return inbox
+
+@contextlib.contextmanager
+def _random_state(states, key):
+  """ Use the `random` state saved under the key, if any, and save it back after """
+  if key not in states:
+    yield
+    return
+  outer = random.getstate()
+  random.setstate(states[key])
+  try:
+    yield
+  finally:
+    states[key] = random.getstate()
+    random.setstate(outer)
+
+def _advance(hand, message, send):
+  """ Give a `hand_messages` generator the message, if any, and send what it
+  says until it wants another. Returns whether the hand is still going, or,
+  if its bot yields a _Decision, that decision, whose result must be given
+  to the hand as its next message. """
+  try:
+    out = hand.send(message)
+    while out is not None:
+      if isinstance(out, _Decision):
+        return out
+      send(out)
+      out = next(hand)
+  except StopIteration:
+    return False
+  return True
+
+def _step(bot, value):
+  """ Send the value to the bot and return what it yields next, yielding any
+  _Decision it waits on to our caller and sending it the result """
+  out = bot.send(value)
+  while isinstance(out, _Decision):
+    out = bot.send((yield out))
+  return out
+
+def hand_messages(bot, *, v2=False):
+  """
+  A hand of the bot, as decoded messages (see wire.py), without the channel.
+  The generator yields each response to send, or None when it wants the next
+  message received, which must be sent in. It's done when the hand is over.
 
-def play_bot_with_channels(bot, channel):
+  In protocol v2, when the bot draws from the discard pile it already knows
+  the card it'll get, so it says what it'll discard in the same message, a
+  wire.DrawAndDiscard, and the server doesn't send it 'drawn'.
 
-    def read(expected_desc):
-      message = channel.recv()
-      desc, payload = message.split(':')
-      assert desc == expected_desc, f"Server and client have fallen out of sync. Server at '{desc}' but client at '{expected_desc}'"
-      return payload
+  If the bot yields a _Decision, so does this generator, and it must be sent
+  the decision's result.
+  """
 
-    def write(desc, payload):
-      message = f"{desc}:{payload}"
-      channel.send(message)
+  def read(expected_desc):
+    desc, *args = yield
+    assert desc == expected_desc, f"Server and client have fallen out of sync. Server at '{desc}' but client at '{expected_desc}'"
+    return args
 
-    starting_hand, who_starts = read('starting').split(';')
-    starting_hand = set(map(Card, starting_hand.split(',')))
-    am_starting = { 'you start': True, 'opponent starts': False }[who_starts]
-    turn = 'ours' if am_starting else 'theirs'
+  starting_hand, am_starting = yield from read('starting')
+  turn = 'ours' if am_starting else 'theirs'
+  # The top of the discard pile, on our turn, is what they last discarded
+  their_discard = None
 
-    next(bot)
-    bot.send((starting_hand, am_starting))
+  next(bot)
+  bot.send((starting_hand, am_starting))
 
-    while True:
+  while True:
 
-      if turn == 'theirs':
-        # get the opponent's move
-        draw_location, discard_choice, end_str = read('opponent_turn').split(';')
-        discard_choice = Card(discard_choice)
-        do_end = { 'end': True, 'continue': False }[end_str]
+    if turn == 'theirs':
+      # get the opponent's move
+      move, = yield from read('opponent_turn')
+      _, discard_choice, do_end = move
 
-        if do_end:
-          break
+      if do_end:
+        break
 
-        move = (draw_location, discard_choice, do_end)
-        next(bot)
-        bot.send(move)
+      their_discard = discard_choice
+      next(bot)
+      bot.send(move)
 
-      elif turn == 'ours':
-        draw_location = next(bot)
-        write('draw_from', draw_location)
-        drawn_card = Card(read('drawn'))
-        discard_choice, do_end = bot.send(drawn_card)
-        write('discard', f"{discard_choice};{do_end}")
+    elif turn == 'ours':
+      draw_location = yield from _step(bot, None)
+      if v2 and draw_location == 'discard' and their_discard is not None:
+        discard_choice, do_end = yield from _step(bot, their_discard)
+        yield wire.DrawAndDiscard(discard_choice, do_end)
+      else:
+        yield draw_location
+        drawn_card, = yield from read('drawn')
+        discard_choice, do_end = yield from _step(bot, drawn_card)
+        yield (discard_choice, do_end)
 
-        if do_end:
-          break
+      if do_end:
+        break
 
-      else:
-        assert False
+    else:
+      assert False
 
-      # Switch turns
-      turn = {
-        'ours': 'theirs',
-        'theirs': 'ours',
-      }[turn]
+    # Switch turns
+    turn = {
+      'ours': 'theirs',
+      'theirs': 'ours',
+    }[turn]
 
 def make_bot(choose_draw, choose_discard, should_end):
   """
@@ -96,6 +319,7 @@ def make_bot(choose_draw, choose_discard, should_end):
       "our_discard"   : the largest sublist of `discard` containing only cards that this player discarded
       "their_discard" : the largest sublist of `discard` containing only cards that the other player discarded
       "other_hand"    : cards that are definitely in the other player's hand
+      "hand_state"    : a gin.HandState mirroring `hand`, for fast deadwood queries
 
   and each should return:
 
@@ -109,13 +333,29 @@ def make_bot(choose_draw, choose_discard, should_end):
 
   Bots MUST NOT mutate any of these values.
   """
+  callbacks = {
+    'draw': choose_draw,
+    'discard': choose_discard,
+    'end': should_end,
+  }
+  return _make_bot(lambda kind, state: callbacks[kind](*state))
+
+def _make_bot(decide):
+  """
+  The bot of `make_bot`, which makes its decisions with `decide(kind, state)`,
+  where `kind` is 'draw', 'discard' or 'end' and `state` is (hand, history, derivables).
+  If `decide` returns a _Decision, the bot yields it rather than deciding, and
+  must be sent the result.
+  """
 
   # Our hand
   hand = set()
+  hand_state = gin.HandState()
 
   # Deck size
   # Need to keep track of in order to know when a reshuffle happens
-  deck_size = 52
+  # Our starting hand is counted as draws below, but theirs is not
+  deck_size = 52 - 10
 
   # History of moves
   history = []
@@ -163,10 +403,12 @@ def make_bot(choose_draw, choose_discard, should_end):
       deck_pop()
 
     hand.add(drawn_card)
+    hand_state.add(drawn_card)
 
   def event__discarded(discard_choice):
     """ Discarded a card. """
     hand.remove(discard_choice)
+    hand_state.remove(discard_choice)
     discard.append(discard_choice)
     our_discard.append(discard_choice)
 
@@ -190,8 +432,15 @@ def make_bot(choose_draw, choose_discard, should_end):
     "other_hand": other_hand,
     "our_discard": our_discard,
     "their_discard": their_discard,
+    "hand_state": hand_state,
   }
 
+  def decided(kind):
+    decision = decide(kind, (hand, history, derivables))
+    if isinstance(decision, _Decision):
+      decision = yield decision
+    return decision
+
   # Who starts? either 'ours' or 'theirs'
   starting_hand, am_starting = yield
   yield
@@ -224,15 +473,15 @@ def make_bot(choose_draw, choose_discard, should_end):
       if len(discard) == 0:
         draw_location = 'deck'
       else:
-        draw_location = choose_draw(hand, history, derivables)
+        draw_location = yield from decided('draw')
       drawn_card = yield draw_location
 
       event__drew(draw_location, drawn_card)
 
-      discard_choice = choose_discard(hand, history, derivables)
+      discard_choice = yield from decided('discard')
       event__discarded(discard_choice)
 
-      do_end = gin.can_end(hand) and should_end(hand, history, derivables)
+      do_end = hand_state.points <= gin.MAX_POINTS_TO_GO_DOWN and (yield from decided('end'))
       event__ending(do_end)
 
       yield (discard_choice, do_end)
@@ -248,3 +497,178 @@ def make_bot(choose_draw, choose_discard, should_end):
       'them': 'us',
     }[active_player]
 
+
+#= batched decisions =#
+
+# A decision a bot is waiting on rather than making, to be made in a batch
+_Decision = collections.namedtuple('_Decision', ['kind', 'state'])
+
+class _Slot:
+  """ Where a submitted decision waits for its result """
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+  def wait(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.result
+
+class DecisionBatcher:
+  """
+  Collects decisions from concurrently running games and makes them in batches.
+
+  `decide(kind, arguments)` gets a list of arguments of one kind and returns a list
+  of their results. `submit(kind, argument)` blocks until the argument's batch has
+  been decided, then returns its result. Pending decisions are decided once there
+  are `max_batch_size` of them, or once every game that has `join`ed is waiting on
+  one, or once the oldest has waited `max_wait` seconds.
+  """
+
+  def __init__(self, decide, *, max_batch_size=64, max_wait=0.005):
+    self.decide = decide
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+
+    self.games = 0
+    # (time submitted, kind, argument, slot)
+    self.pending = []
+    self.batch_sizes = collections.Counter()
+    self.condition = threading.Condition()
+
+    self.closed = False
+    self.thread = threading.Thread(target=self._flush_forever, daemon=True)
+    self.thread.start()
+
+  def join(self):
+    with self.condition:
+      self.games += 1
+
+  def leave(self):
+    with self.condition:
+      self.games -= 1
+      self.condition.notify()
+
+  def submit(self, kind, argument):
+    slot = _Slot()
+    with self.condition:
+      if self.closed:
+        raise RuntimeError("The batcher has been closed.")
+      self.pending.append((time.monotonic(), kind, argument, slot))
+      self.condition.notify()
+    return slot.wait()
+
+  def decide_now(self, decisions):
+    """ Make a list of _Decisions in this thread, in batches of up to
+    `max_batch_size`, and return their results """
+    slots = [ _Slot() for _ in decisions ]
+    entries = [ (None, decision.kind, decision.state, slot) for decision, slot in zip(decisions, slots) ]
+    for start in range(0, len(entries), self.max_batch_size):
+      batch = entries[start:start + self.max_batch_size]
+      self.batch_sizes[len(batch)] += 1
+      self._decide(batch)
+    return [ slot.wait() for slot in slots ]
+
+  def close(self):
+    """ Decide whatever is pending and stop """
+    with self.condition:
+      self.closed = True
+      self.condition.notify()
+    self.thread.join()
+
+  def _ready(self):
+    if len(self.pending) >= min(self.max_batch_size, max(self.games, 1)) or self.closed:
+      return True
+    return time.monotonic() - self.pending[0][0] >= self.max_wait
+
+  def _flush_forever(self):
+    while True:
+      with self.condition:
+        while not (self.pending and self._ready()):
+          if self.closed and not self.pending:
+            return
+          if self.pending:
+            self.condition.wait(self.pending[0][0] + self.max_wait - time.monotonic())
+          else:
+            self.condition.wait()
+        batch = self.pending[:self.max_batch_size]
+        del self.pending[:self.max_batch_size]
+
+      self.batch_sizes[len(batch)] += 1
+      self._decide(batch)
+
+  def _decide(self, batch):
+    kinds = {}
+    for _, kind, argument, slot in batch:
+      kinds.setdefault(kind, []).append((argument, slot))
+
+    for kind, entries in kinds.items():
+      arguments = [ argument for argument, _ in entries ]
+      try:
+        results = self.decide(kind, arguments)
+        if len(results) != len(arguments):
+          raise ValueError(f"Got {len(results)} results for {len(arguments)} '{kind}' decisions.")
+      except Exception as error:
+        for _, slot in entries:
+          slot.error = error
+          slot.done.set()
+        continue
+
+      for (_, slot), result in zip(entries, results):
+        slot.result = result
+        slot.done.set()
+
+class BatchBot:
+  """ A bot which makes the decisions of all of its games in batches; see `make_batch_bot` """
+
+  def __init__(self, choose_draws, choose_discards, should_ends, *, max_batch_size=64, max_wait=0.005):
+    callbacks = {
+      'draw': choose_draws,
+      'discard': choose_discards,
+      'end': should_ends,
+    }
+    self.batcher = DecisionBatcher(
+      lambda kind, states: callbacks[kind](states),
+      max_batch_size=max_batch_size,
+      max_wait=max_wait,
+    )
+
+  def bot(self):
+    """ A bot for one game, as from `make_bot` """
+    return self._playing(_make_bot(self.batcher.submit))
+
+  def deferring_bot(self):
+    """ A bot for one game which, rather than waiting on its decisions,
+    yields them as _Decisions; see `play_multiplexed` """
+    return _make_bot(_Decision)
+
+  def _playing(self, bot):
+    self.batcher.join()
+    try:
+      return (yield from bot)
+    finally:
+      self.batcher.leave()
+
+  def close(self):
+    self.batcher.close()
+
+def make_batch_bot(choose_draws, choose_discards, should_ends, *, max_batch_size=64, max_wait=0.005):
+  """
+  Like `make_bot`, but for bots which decide for many games at once.
+
+  Each function takes a list of (hand, history, derivables) states, one per game,
+  as described in `make_bot`, and returns a list of decisions in the same order.
+  Returns a BatchBot, whose `bot()` makes a bot for a single game. The decisions
+  of games played concurrently, e.g. in threads, are made together, in batches of
+  up to `max_batch_size`; a decision waits at most `max_wait` seconds for others
+  to join its batch. A bot process started with `play_bot(batch_bot)` decides the
+  hands it plays at once together, without threads.
+  """
+  return BatchBot(
+    choose_draws, choose_discards, should_ends,
+    max_batch_size=max_batch_size,
+    max_wait=max_wait,
+  )
@@ -2,9 +2,13 @@
 
 import random
 import itertools as it
+import functools
+import inspect
+from array import array
 
-from cards import Card, all_cards
-from util import powerset, pairwise, flatten, union
+import cards
+from cards import Card, all_cards, RANK_MASK
+from util import powerset, pairwise, union, popcount, LRUCache
 
 
 UNDERCUT_BONUS = 10
@@ -34,10 +38,8 @@ def is_meld(cards):
 def get_pairs(cards):
   return filter(is_pair, map(frozenset, it.combinations(cards, 2)))
 
-def get_melds(cards):
-  melds_3 = filter(is_meld, map(frozenset, it.combinations(cards, 3)))
-  melds_4 = filter(is_meld, map(frozenset, it.combinations(cards, 4)))
-  return frozenset({*melds_3, *melds_4})
+def get_melds(hand):
+  return frozenset(MELD_CARDS[meld] for meld in get_melds_mask(cards.hand_to_mask(hand)))
 
 def conflicting(melds):
   """ two melds contain the same card """
@@ -48,63 +50,466 @@ def sum_cards_value(cards):
 
 def arrange_hand(hand):
   """ Arrange a hand into (melds, deadwood)"""
-  # adapted from https://discardoverflow.com/a/542706/4781072
-  all_possible_melds = get_melds(hand)
-  meld_sets = powerset(all_possible_melds)
-  valid_meld_sets = it.filterfalse(conflicting, meld_sets)
-
-  def deadwood(meld_set):
-    meld_cards = frozenset(flatten(meld_set))
-    return frozenset(hand - meld_cards)
-
-  def points_leftover(meld_set):
-    return sum_cards_value(deadwood(meld_set))
-
-  best_meld_set = min(valid_meld_sets, key=points_leftover)
-  return best_meld_set, deadwood(best_meld_set)
+  meld_masks, deadwood_mask = arrange_hand_mask(cards.hand_to_mask(hand))
+  melds = frozenset(frozenset(cards.mask_to_hand(meld)) for meld in meld_masks)
+  return melds, frozenset(cards.mask_to_hand(deadwood_mask))
 
 def points_leftover(our_hand, their_hand=None):
   """ How many deadwood points does this hand have?
   If a second hand is provided, deadwood in this hand will be played on the other hand's melds. """
-  if their_hand: their_melds, their_deadwood = arrange_hand(their_hand)
-  our_melds, our_deadwood = arrange_hand(our_hand)
-  if their_hand: our_deadwood = frozenset(it.filterfalse(extends_any_meld(their_melds), our_deadwood))
-  return sum_cards_value(our_deadwood)
+  their_mask = cards.hand_to_mask(their_hand) if their_hand else 0
+  return points_leftover_mask(cards.hand_to_mask(our_hand), their_mask)
+
+def evaluate_discards(hand, their_hand=None):
+  """ For each card in the hand, how many deadwood points would be left after
+  discarding it? Returns a dict of card to points.
+  Like `points_leftover`, if a second hand is provided, deadwood will be played
+  on the other hand's melds. Equivalent to, but faster than,
+
+    { card: points_leftover(hand - {card}, their_hand) for card in hand } """
+  their_mask = cards.hand_to_mask(their_hand) if their_hand else 0
+  by_index = evaluate_discards_mask(cards.hand_to_mask(hand), their_mask)
+  return { cards.cards_by_index[index]: points for index, points in by_index.items() }
 
 def extends_any_meld(melds):
   """ returns a predicate of a card that decides whether that card can
   extend any of these given melds """
-  return lambda card: any(is_meld(meld | {card}) for meld in melds)
+  extensions = extends_any_meld_mask(map(cards.hand_to_mask, melds))
+  return lambda card: bool(extensions >> card.index & 1)
 
 def extends_any_pair(pairs):
   """ returns a predicate of a card that decides whether that card can
-  extend any of these given pairs """
-  #TODO unify with above
-  return lambda card: any(is_pair(pair | {card}) for pair in pairs)
+  extend any of these given pairs into a meld """
+  # A card extends a pair exactly when it extends a (two-card) partial meld
+  return extends_any_meld(pairs)
+
+def layoffs(melds, deadwood):
+  """ the cards of `deadwood` which can be laid off on these melds,
+  including chains of cards on the ends of runs """
+  index = layoff_index_mask(map(cards.hand_to_mask, melds))
+  return frozenset(cards.mask_to_hand(layoffs_mask(index, cards.hand_to_mask(deadwood))))
 
 def can_end(hand):
   """ is the player able to end the game, given the current hand? """
-  return points_leftover(hand) <= MAX_POINTS_TO_GO_DOWN
+  return can_end_mask(cards.hand_to_mask(hand))
+
+def is_gin(hand):
+  """ does the hand have no deadwood at all? """
+  return is_gin_mask(cards.hand_to_mask(hand))
 
 def score_hand(our_hand, their_hand):
   """ Accepts two hands. The first hand is that of the player who ended the game.
   Calculates the number of points that that player scores. """
+  return score_hand_mask(cards.hand_to_mask(our_hand), cards.hand_to_mask(their_hand))
+
+#= bitmask versions =#
+
+# The functions below mirror the ones above but work on hands encoded as
+# 52-bit integers (see the bitmask encoding in cards.py). A meld is the mask
+# of its cards, so unions, differences and conflict checks are integer ops.
+
+SUIT_BLOCKS = tuple(RANK_MASK << (13 * suit) for suit in range(4))
+RANK_COLUMNS = tuple(sum(1 << (13 * suit + rank) for suit in range(4)) for rank in range(13))
+
+def _suit_value(ranks):
+  return sum(min(rank + 1, 10) for rank in range(13) if ranks & (1 << rank))
+
+# Value of every possible set of ranks within a single suit
+SUIT_VALUES = tuple(_suit_value(ranks) for ranks in range(1 << 13))
+
+def mask_value(mask):
+  """ Total value of the cards in the mask """
+  return ( SUIT_VALUES[mask & RANK_MASK]
+         + SUIT_VALUES[(mask >> 13) & RANK_MASK]
+         + SUIT_VALUES[(mask >> 26) & RANK_MASK]
+         + SUIT_VALUES[(mask >> 39) & RANK_MASK] )
+
+def is_run_mask(meld):
+  """ Whether a meld lies within one suit, i.e. is a run rather than a book """
+  return any(meld & block == meld for block in SUIT_BLOCKS)
+
+def _find_melds_mask(hand):
+  """ All melds that can be made from the hand, found by scanning it """
+  melds = []
+
+  # runs
+  for suit, block in enumerate(SUIT_BLOCKS):
+    ranks = (hand & block) >> (13 * suit)
+    starts_3 = ranks & (ranks >> 1) & (ranks >> 2)
+    starts_4 = starts_3 & (ranks >> 3)
+    for start in cards.mask_indices(starts_3):
+      melds.append(0b111 << (13 * suit + start))
+    for start in cards.mask_indices(starts_4):
+      melds.append(0b1111 << (13 * suit + start))
+
+  # books
+  for column in RANK_COLUMNS:
+    book = hand & column
+    if popcount(book) == 4:
+      melds.append(book)
+      for low in cards.mask_indices(book):
+        melds.append(book ^ (1 << low))
+    elif popcount(book) == 3:
+      melds.append(book)
+
+  return melds
+
+#= meld tables =#
+
+# Every meld in the deck
+ALL_MELDS = tuple(_find_melds_mask(cards.ALL_CARDS_MASK))
+
+# The cards of each meld, keyed by meld mask
+MELD_CARDS = { meld: frozenset(cards.mask_to_hand(meld)) for meld in ALL_MELDS }
+
+# Indexed by card index: all melds containing that card,
+# and the melds whose lowest card it is (so each meld is listed once)
+MELDS_BY_CARD = tuple( tuple(meld for meld in ALL_MELDS if meld >> index & 1) for index in range(52) )
+MELDS_LED_BY_CARD = tuple( tuple(meld for meld in MELDS_BY_CARD[index] if meld & -meld == 1 << index) for index in range(52) )
+
+def _meld_completions():
+  """ For every meld, and every meld minus one card (pairs included),
+  the mask of cards which, added to it, would make a meld """
+  completions = {}
+  for meld in ALL_MELDS:
+    # a meld plus one of its own cards is still that meld
+    completions[meld] = completions.get(meld, 0) | meld
+    for index in cards.mask_indices(meld):
+      part = meld ^ (1 << index)
+      completions[part] = completions.get(part, 0) | (1 << index)
+  return completions
+
+MELD_COMPLETIONS = _meld_completions()
+
+def get_melds_mask(hand):
+  """ All melds that can be made from the hand, as a list of masks """
+  return [ meld
+           for index in cards.mask_indices(hand)
+           for meld in MELDS_LED_BY_CARD[index]
+           if meld & hand == meld ]
+
+def conflicting_masks(melds):
+  """ two melds contain the same card """
+  seen = 0
+  for meld in melds:
+    if seen & meld:
+      return True
+    seen |= meld
+  return False
+
+def _best_runs_table():
+  """ For every set of ranks within a single suit, find the way of splitting it
+  into runs and deadwood which leaves the least deadwood.
+  Returns (deadwood points, runs) tables, each indexed by rank mask. """
+
+  deadwood_points = [0] * (1 << 13)
+  runs = [()] * (1 << 13)
+
+  # The lowest card is either deadwood or starts a run, and removing
+  # either leaves a smaller mask, so fill the table in increasing order.
+  for ranks in range(1, 1 << 13):
+    low = ranks & -ranks
+    low_rank = low.bit_length() - 1
+
+    best_points = min(low_rank + 1, 10) + deadwood_points[ranks ^ low]
+    best_runs = runs[ranks ^ low]
+
+    for run in (0b111 << low_rank, 0b1111 << low_rank):
+      if run & ranks == run and run <= RANK_MASK and deadwood_points[ranks ^ run] < best_points:
+        best_points = deadwood_points[ranks ^ run]
+        best_runs = (run, *runs[ranks ^ run])
+
+    deadwood_points[ranks] = best_points
+    runs[ranks] = best_runs
+
+  return tuple(deadwood_points), tuple(runs)
+
+RUN_DEADWOOD_POINTS, BEST_RUNS = _best_runs_table()
+RUN_DEADWOOD = tuple( ranks & ~union(runs, 0) for ranks, runs in enumerate(BEST_RUNS) )
+
+def _book_choices(book):
+  """ The ways to use the cards of a single rank as a book: none, all four, or any three """
+  if popcount(book) == 3:
+    return (0, book)
+  return (0, book, *(book ^ (1 << low) for low in cards.mask_indices(book)))
+
+def arrange_hand_mask_uncached(hand):
+  """ Arrange a hand mask into (meld masks, deadwood mask)
+
+  Since runs live within one suit and books within one rank, once we decide
+  which books to make, the best runs for each suit can be looked up in a
+  precomputed table. A hand of 11 cards has at most three ranks which can
+  form a book, so there are few book choices to try. """
+
+  books = [ hand & column for column in RANK_COLUMNS if popcount(hand & column) >= 3 ]
+
+  best_points = None
+  for book_choice in it.product(*map(_book_choices, books)):
+    rest = hand & ~union(book_choice, 0)
+    points = ( RUN_DEADWOOD_POINTS[rest & RANK_MASK]
+             + RUN_DEADWOOD_POINTS[(rest >> 13) & RANK_MASK]
+             + RUN_DEADWOOD_POINTS[(rest >> 26) & RANK_MASK]
+             + RUN_DEADWOOD_POINTS[(rest >> 39) & RANK_MASK] )
+    if best_points is None or points < best_points:
+      best_points, best_choice, best_rest = points, book_choice, rest
+
+  melds = [ book for book in best_choice if book ]
+  for suit in range(4):
+    for run in BEST_RUNS[(best_rest >> (13 * suit)) & RANK_MASK]:
+      melds.append(run << (13 * suit))
+
+  return tuple(melds), hand & ~union(melds, 0)
+
+#= suit canonicalization =#
+
+# Melds and deadwood don't care which suit is which, so hands which differ
+# only by a permutation of suits can share one arrangement. A hand's canonical
+# form has its suits reordered so that their rank masks are decreasing.
+
+def permute_suits(mask, permutation):
+  """ Move suit `permutation[i]` of the mask to suit `i` """
+  return ( ((mask >> (13 * permutation[0])) & RANK_MASK)
+         | ((mask >> (13 * permutation[1])) & RANK_MASK) << 13
+         | ((mask >> (13 * permutation[2])) & RANK_MASK) << 26
+         | ((mask >> (13 * permutation[3])) & RANK_MASK) << 39 )
+
+def unpermute_suits(mask, permutation):
+  """ Undo `permute_suits` """
+  return ( ((mask      ) & RANK_MASK) << (13 * permutation[0])
+         | ((mask >> 13) & RANK_MASK) << (13 * permutation[1])
+         | ((mask >> 26) & RANK_MASK) << (13 * permutation[2])
+         | ((mask >> 39) & RANK_MASK) << (13 * permutation[3]) )
+
+def canonicalize_hand(mask):
+  """ Returns (canonical mask, permutation), where the canonical mask is
+  `permute_suits(mask, permutation)` """
+  suits = cards.suit_masks(mask)
+  permutation = tuple(sorted(range(4), key=lambda suit: -suits[suit]))
+  return permute_suits(mask, permutation), permutation
+
+def canonicalize_hands(mask1, mask2):
+  """ Like `canonicalize_hand` but for two hands at once, permuted alike.
+  Returns (canonical mask 1, canonical mask 2, permutation). """
+  suits1 = cards.suit_masks(mask1)
+  suits2 = cards.suit_masks(mask2)
+  permutation = tuple(sorted(range(4), key=lambda suit: (-suits1[suit], -suits2[suit])))
+  return permute_suits(mask1, permutation), permute_suits(mask2, permutation), permutation
+
+def has_alike_suits(mask):
+  """ Whether two suits of the hand hold the same (non-empty) ranks """
+  suits = [ ranks for ranks in cards.suit_masks(mask) if ranks ]
+  return len(set(suits)) != len(suits)
+
+#= arrangement cache =#
+
+# Bots arrange the same hands over and over, so remember recent arrangements.
+# The cache is keyed on canonical hands, so one entry serves up to 24 hands.
+ARRANGEMENT_CACHE_SIZE = 200000
+arrangement_cache = LRUCache(ARRANGEMENT_CACHE_SIZE)
+
+def arrange_hand_mask(hand):
+  """ Arrange a hand mask into (meld masks, deadwood mask), using the cache """
+  canonical, permutation = canonicalize_hand(hand)
+  melds, deadwood = arrangement_cache.get(canonical, arrange_hand_mask_uncached)
+  melds = tuple(unpermute_suits(meld, permutation) for meld in melds)
+  return melds, unpermute_suits(deadwood, permutation)
+
+def arrangement_cache_stats():
+  """ Returns a dict of the cache's hits, misses, evictions, size and max_size """
+  return arrangement_cache.stats()
+
+def set_arrangement_cache_size(max_size):
+  """ Set the maximum number of cached arrangements; 0 disables the cache """
+  arrangement_cache.resize(max_size)
+
+def save_arrangement_cache(path):
+  arrangement_cache.save(path)
+
+def load_arrangement_cache(path):
+  """ Warm the cache from a file written by `save_arrangement_cache`, if it exists """
+  arrangement_cache.load(path)
+
+def arrange_hand_mask_reference(hand):
+  """ Slow but obviously-correct version of `arrange_hand_mask`, which tries
+  every combination of melds. Kept around for testing. """
+  # adapted from https://discardoverflow.com/a/542706/4781072
+  meld_sets = powerset(get_melds_mask(hand))
+  valid_meld_sets = it.filterfalse(conflicting_masks, meld_sets)
+
+  def deadwood(meld_set):
+    return hand & ~union(meld_set, 0)
+
+  best_meld_set = min(valid_meld_sets, key=lambda meld_set: mask_value(deadwood(meld_set)))
+  return best_meld_set, deadwood(best_meld_set)
+
+def extends_any_meld_mask(melds):
+  """ Mask of cards which would extend any of these melds (or partial melds).
+  Like `extends_any_meld`, cards already in a meld count as extending it. """
+  extensions = 0
+  for meld in melds:
+    extensions |= MELD_COMPLETIONS.get(meld, 0)
+  return extensions
+
+#= layoffs =#
+
+# Cards of every rank but the lowest / highest; for shifting ranks up / down
+# without spilling into the neighbouring suit
+NOT_LOWEST_RANKS = cards.ALL_CARDS_MASK & ~RANK_COLUMNS[0]
+NOT_HIGHEST_RANKS = cards.ALL_CARDS_MASK & ~RANK_COLUMNS[12]
+
+def layoff_index_mask(melds):
+  """ Index what can be laid off on the given melds, for use with `layoffs_mask`.
+  Returns (cards in runs, cards of the books' ranks) as masks. """
+  runs = 0
+  books = 0
+  for meld in melds:
+    if is_run_mask(meld):
+      runs |= meld
+    else:
+      rank = ((meld & -meld).bit_length() - 1) % 13
+      books |= RANK_COLUMNS[rank]
+  return runs, books
+
+def layoffs_mask(layoff_index, deadwood):
+  """ The cards of `deadwood` which can be laid off on the indexed melds.
+
+  A book takes any card of its rank. A run takes the next card at either end,
+  and then the card after that, and so on, so the 9 and 10 can both be laid
+  off on a 6-7-8. Like `extends_any_meld`, cards already in a meld count. """
+  runs, books = layoff_index
+
+  reach = runs
+  while True:
+    grow = (((reach << 1) & NOT_LOWEST_RANKS) | ((reach >> 1) & NOT_HIGHEST_RANKS)) & deadwood & ~reach
+    if not grow:
+      break
+    reach |= grow
+
+  return deadwood & (reach | books)
+
+def points_leftover_mask(our_hand, their_hand=0):
+  """ `points_leftover` for masks """
+  our_melds, our_deadwood = arrange_hand_mask(our_hand)
+  if their_hand:
+    their_melds, their_deadwood = arrange_hand_mask(their_hand)
+    our_deadwood &= ~layoffs_mask(layoff_index_mask(their_melds), our_deadwood)
+  return mask_value(our_deadwood)
+
+def evaluate_discards_mask(hand, their_hand=0):
+  """ For every card in the hand, `points_leftover_mask(hand - card, their_hand)`.
+  Returns a dict of card index to points.
+
+  Rather than solving each smaller hand separately, this goes through the
+  hand's book choices (see `arrange_hand_mask_uncached`) once, and for each
+  card not in the chosen books, works out the deadwood without that card by
+  looking up only the card's suit again. """
+
+  books = [ hand & column for column in RANK_COLUMNS if popcount(hand & column) >= 3 ]
+
+  # card index -> [points, rest of hand after books and discard, is tied]
+  best = {}
+  for book_choice in it.product(*map(_book_choices, books)):
+    rest = hand & ~union(book_choice, 0)
+    suit_rest = cards.suit_masks(rest)
+    suit_points = [ RUN_DEADWOOD_POINTS[ranks] for ranks in suit_rest ]
+    total = sum(suit_points)
+
+    for index in cards.mask_indices(rest):
+      suit, rank = divmod(index, 13)
+      points = total - suit_points[suit] + RUN_DEADWOOD_POINTS[suit_rest[suit] ^ (1 << rank)]
+      entry = best.get(index)
+      if entry is None or points < entry[0]:
+        best[index] = [points, rest ^ (1 << index), False]
+      elif points == entry[0]:
+        entry[2] = True
+
+  if not their_hand:
+    return { index: points for index, (points, _, _) in best.items() }
+
+  their_melds, _ = arrange_hand_mask(their_hand)
+  layoff_index = layoff_index_mask(their_melds)
+
+  result = {}
+  for index, (points, rest, is_tied) in best.items():
+    if is_tied:
+      # Which of the equally good arrangements `arrange_hand_mask` picks
+      # can change the layoffs, so ask it
+      result[index] = points_leftover_mask(hand ^ (1 << index), their_hand)
+    else:
+      deadwood = cards.mask_from_suit_masks(RUN_DEADWOOD[ranks] for ranks in cards.suit_masks(rest))
+      result[index] = mask_value(deadwood & ~layoffs_mask(layoff_index, deadwood))
+  return result
+
+def deadwood_bounds_mask(hand):
+  """ Cheap (lower, upper) bounds on `points_leftover_mask(hand)`.
+
+  The lower bound counts the cards which aren't in any meld of the hand, i.e.
+  which neither have two neighbours in a row in their suit nor two others of
+  their rank. The upper bound is the deadwood when making only runs. When no
+  rank has three cards there are no books, so the upper bound is exact, and
+  it's returned as the lower bound too. """
+  a, b, c, d = cards.suit_masks(hand)
+
+  # ranks held in at least three suits
+  book_ranks = (a & b & c) | (a & b & d) | (a & c & d) | (b & c & d)
+
+  unmatched = 0
+  upper = 0
+  for suit, ranks in enumerate((a, b, c, d)):
+    starts = ranks & (ranks >> 1) & (ranks >> 2)
+    in_run = starts | (starts << 1) | (starts << 2)
+    unmatched |= (ranks & ~in_run & ~book_ranks) << (13 * suit)
+    upper += RUN_DEADWOOD_POINTS[ranks]
+
+  if not book_ranks:
+    return upper, upper
+  return mask_value(unmatched), upper
+
+def can_end_mask(hand):
+  """ `can_end` for masks. Only arranges the hand if the bounds can't decide. """
+  lower, upper = deadwood_bounds_mask(hand)
+  if lower > MAX_POINTS_TO_GO_DOWN: return False
+  if upper <= MAX_POINTS_TO_GO_DOWN: return True
+  return points_leftover_mask(hand) <= MAX_POINTS_TO_GO_DOWN
+
+def is_gin_mask(hand):
+  """ `is_gin` for masks. Only arranges the hand if the bounds can't decide. """
+  lower, upper = deadwood_bounds_mask(hand)
+  if lower > 0: return False
+  if upper == 0: return True
+  return points_leftover_mask(hand) == 0
+
+SCORE_CACHE_SIZE = 100000
+score_cache = LRUCache(SCORE_CACHE_SIZE)
+
+def score_hand_mask(our_hand, their_hand):
+  """ `score_hand` for masks. Scores are cached by the hands' canonical form. """
+  # When two suits of a hand are alike, which of them the cached arrangement
+  # uses depends on the permutation, and so can the layoffs; don't cache those
+  if has_alike_suits(our_hand) or has_alike_suits(their_hand):
+    return _score_hand_mask_uncached((our_hand, their_hand))
+
+  our_canonical, their_canonical, _ = canonicalize_hands(our_hand, their_hand)
+  return score_cache.get((our_canonical, their_canonical), _score_hand_mask_uncached)
+
+def _score_hand_mask_uncached(hands):
+  our_hand, their_hand = hands
 
   # First arrange our hand as best as possible
-  our_melds, our_deadwood = arrange_hand(our_hand)
-  is_gin = len(our_deadwood) == 0
+  our_melds, our_deadwood = arrange_hand_mask(our_hand)
+  is_gin = our_deadwood == 0
 
   # Now arrange the their hand
-  their_melds, their_deadwood = arrange_hand(their_hand)
+  their_melds, their_deadwood = arrange_hand_mask(their_hand)
 
   # As long as we didn't Gin,
   # They can play their deadwood on our melds
   if not is_gin:
-    their_deadwood = frozenset(it.filterfalse(extends_any_meld(our_melds), their_deadwood))
+    their_deadwood &= ~layoffs_mask(layoff_index_mask(our_melds), their_deadwood)
 
   # Calculate number of points in each hand
-  our_points = sum_cards_value(our_deadwood)
-  their_points = sum_cards_value(their_deadwood)
+  our_points = mask_value(our_deadwood)
+  their_points = mask_value(their_deadwood)
 
   # Check if an undercut
   if their_points <= our_points:
@@ -122,7 +527,414 @@ def score_hand(our_hand, their_hand):
     if is_gin: our_score += GIN_BONUS
     return our_score
 
-def play_hand(player1, player2, *, state_callback=lambda x: None):
+#= incremental hand state =#
+
+class HandState:
+  """
+  A mutable hand which keeps track of its deadwood as cards are added and removed.
+
+  Alongside the hand mask this keeps each suit's rank mask, the number of
+  cards of each rank, and each suit's run-only deadwood. As long as no rank
+  has three or more cards, the deadwood is just the sum of the suits' run-only
+  deadwood, so adding or removing a card only needs one table lookup.
+  Otherwise books are possible and we fall back to the (cached) solver.
+
+    >>> state = HandState(hand)
+    >>> state.add(drawn_card)
+    >>> discard = min(state, key=state.points_without)
+    >>> state.remove(discard)
+    >>> state.points
+  """
+
+  def __init__(self, hand=()):
+    self.mask = 0
+    self.suits = [0] * 4
+    self.suit_points = [0] * 4
+    self.rank_counts = [0] * 13
+    self.book_ranks = set()
+    self._invalidate()
+
+    for card in hand:
+      self.add(card)
+
+  def _invalidate(self):
+    self._points = None
+    self._arrangement = None
+    self._points_without = {}
+
+  def _update(self, card, delta):
+    suit, rank = divmod(card.index, 13)
+    self.mask ^= 1 << card.index
+    self.suits[suit] ^= 1 << rank
+    self.suit_points[suit] = RUN_DEADWOOD_POINTS[self.suits[suit]]
+    self.rank_counts[rank] += delta
+    if self.rank_counts[rank] >= 3:
+      self.book_ranks.add(rank)
+    else:
+      self.book_ranks.discard(rank)
+    self._invalidate()
+
+  def add(self, card):
+    if card in self:
+      raise ValueError(f"{card} is already in the hand.")
+    self._update(card, +1)
+
+  def remove(self, card):
+    if card not in self:
+      raise ValueError(f"{card} is not in the hand.")
+    self._update(card, -1)
+
+  def __contains__(self, card):
+    return bool(self.mask >> card.index & 1)
+
+  def __iter__(self):
+    return (cards.cards_by_index[index] for index in cards.mask_indices(self.mask))
+
+  def __len__(self):
+    return popcount(self.mask)
+
+  @property
+  def points(self):
+    """ Deadwood points of the hand """
+    if self._points is None:
+      if self.book_ranks:
+        self._points = mask_value(self.arrangement[1])
+      else:
+        self._points = sum(self.suit_points)
+    return self._points
+
+  @property
+  def arrangement(self):
+    """ (meld masks, deadwood mask), as from `arrange_hand_mask` """
+    if self._arrangement is None:
+      self._arrangement = arrange_hand_mask(self.mask)
+    return self._arrangement
+
+  def points_without(self, card):
+    """ Deadwood points of the hand if this card were discarded """
+    if card not in self._points_without:
+      if card not in self:
+        raise ValueError(f"{card} is not in the hand.")
+
+      suit, rank = divmod(card.index, 13)
+      if self.book_ranks - {rank} or self.rank_counts[rank] > 3:
+        points = mask_value(arrange_hand_mask(self.mask & ~(1 << card.index))[1])
+      else:
+        points = ( sum(self.suit_points) - self.suit_points[suit]
+                 + RUN_DEADWOOD_POINTS[self.suits[suit] & ~(1 << rank)] )
+      self._points_without[card] = points
+
+    return self._points_without[card]
+
+#= game state for search =#
+
+class GameState:
+  """
+  A compact, mutable game state for bots which search through possible futures.
+
+  Hands are masks and the discard pile is an array of card indices. The deck
+  is every card that is in neither hand nor the discard, so that a bot can
+  build a state from what it knows and treat unknown cards as drawable.
+
+  Moves are tuples (draw_location, drawn_card, discard_choice, do_end), as Cards.
+  `apply` makes a move in place and `undo` takes back the last one:
+
+    >>> for move in state.sample_moves(5):
+    ...   state.apply(move)
+    ...   search(state)
+    ...   state.undo()
+
+  Reshuffling the discard into the deck is not modelled; once the deck is
+  empty, the only moves are draws from the discard.
+  """
+
+  __slots__ = ('hands', 'discard', 'discard_mask', 'turn', 'ended', '_history')
+
+  def __init__(self, hand1, hand2, discard=(), *, turn=0):
+    """ Hands are masks; `discard` is Cards, oldest first; `turn` is the index of the active player """
+    self.hands = [hand1, hand2]
+    self.discard = array('b', (card.index for card in discard))
+    self.discard_mask = cards.hand_to_mask(discard)
+    if hand1 & hand2 or (hand1 | hand2) & self.discard_mask:
+      raise ValueError("The hands and discard pile must not share cards.")
+    self.turn = turn
+    self.ended = False
+    self._history = []
+
+  @property
+  def deck(self):
+    return cards.ALL_CARDS_MASK & ~(self.hands[0] | self.hands[1] | self.discard_mask)
+
+  def _draws(self):
+    """ (draw_location, card index) pairs, discard first """
+    if self.discard:
+      yield ('discard', self.discard[-1])
+    for index in cards.mask_indices(self.deck):
+      yield ('deck', index)
+
+  def _draw_count(self):
+    return (1 if self.discard else 0) + popcount(self.deck)
+
+  def _move(self, draw_location, drawn, discard_choice, do_end):
+    by_index = cards.cards_by_index
+    return (draw_location, by_index[drawn], by_index[discard_choice], do_end)
+
+  def moves(self):
+    """ Lazily generate every legal move. Ending is only legal on few enough points. """
+    if self.ended:
+      return
+    hand = self.hands[self.turn]
+    for draw_location, drawn in self._draws():
+      after_draw = hand | (1 << drawn)
+      for discard_choice in cards.mask_indices(after_draw):
+        yield self._move(draw_location, drawn, discard_choice, False)
+        if can_end_mask(after_draw ^ (1 << discard_choice)):
+          yield self._move(draw_location, drawn, discard_choice, True)
+
+  def sample_moves(self, n, rng=random):
+    """ Up to `n` distinct legal moves, chosen uniformly at random.
+
+    Rather than listing every move, this numbers the (draw, discard, do_end)
+    choices and decodes random numbers, skipping illegal ends. """
+    if self.ended:
+      return []
+
+    hand = self.hands[self.turn]
+    discards_per_draw = popcount(hand) + 1
+    total = self._draw_count() * discards_per_draw * 2
+
+    chosen = []
+    tried = set()
+    while len(chosen) < n and len(tried) < total:
+      number = rng.randrange(total)
+      if number in tried:
+        continue
+      tried.add(number)
+
+      draw_number, rest = divmod(number, discards_per_draw * 2)
+      discard_number, do_end = divmod(rest, 2)
+
+      if self.discard and draw_number == 0:
+        draw_location, drawn = 'discard', self.discard[-1]
+      else:
+        draw_location = 'deck'
+        deck_number = draw_number - (1 if self.discard else 0)
+        drawn = next(it.islice(cards.mask_indices(self.deck), deck_number, None))
+
+      after_draw = hand | (1 << drawn)
+      discard_choice = next(it.islice(cards.mask_indices(after_draw), discard_number, None))
+      if do_end and not can_end_mask(after_draw ^ (1 << discard_choice)):
+        continue
+
+      chosen.append(self._move(draw_location, drawn, discard_choice, bool(do_end)))
+
+    return chosen
+
+  def apply(self, move):
+    """ Make a move for the active player """
+    draw_location, drawn_card, discard_choice, do_end = move
+    drawn = drawn_card.index
+    hand = self.hands[self.turn]
+
+    if draw_location == 'discard':
+      if not self.discard or self.discard[-1] != drawn:
+        raise ValueError(f"{drawn_card} is not on top of the discard pile.")
+      self.discard.pop()
+      self.discard_mask ^= 1 << drawn
+    elif not self.deck >> drawn & 1:
+      raise ValueError(f"{drawn_card} is not in the deck.")
+
+    hand |= 1 << drawn
+    if not hand >> discard_choice.index & 1:
+      raise ValueError(f"Cannot discard {discard_choice} since it's not in your hand.")
+    hand ^= 1 << discard_choice.index
+
+    self.hands[self.turn] = hand
+    self.discard.append(discard_choice.index)
+    self.discard_mask |= 1 << discard_choice.index
+    self._history.append(move)
+
+    self.ended = do_end
+    if not do_end:
+      self.turn = 1 - self.turn
+
+  def undo(self):
+    """ Take back the last move """
+    draw_location, drawn_card, discard_choice, do_end = self._history.pop()
+
+    if not do_end:
+      self.turn = 1 - self.turn
+    self.ended = False
+
+    self.discard.pop()
+    self.discard_mask ^= 1 << discard_choice.index
+
+    hand = self.hands[self.turn]
+    hand |= 1 << discard_choice.index
+    hand ^= 1 << drawn_card.index
+    self.hands[self.turn] = hand
+
+    if draw_location == 'discard':
+      self.discard.append(drawn_card.index)
+      self.discard_mask |= 1 << drawn_card.index
+
+  def score(self):
+    """ If the game has ended, the score as for `play_hand`: positive if player 1 won """
+    knocker = self.turn
+    result = score_hand_mask(self.hands[knocker], self.hands[1 - knocker])
+    return result if knocker == 0 else -result
+
+#= batch evaluation =#
+
+# NumPy versions of the above for evaluating many hands in one call.
+# NumPy is imported lazily so that bots which don't use these needn't have it.
+
+@functools.lru_cache(maxsize=None)
+def _batch_tables():
+  import numpy as np
+  run_melded = [ union(runs, 0) for runs in BEST_RUNS ]
+  return ( np.array(RUN_DEADWOOD_POINTS, dtype=np.int64),
+           np.array(run_melded, dtype=np.uint64),
+           np.array(SUIT_VALUES, dtype=np.int64) )
+
+def mask_value_batch(masks):
+  """ `mask_value` for an array of masks """
+  import numpy as np
+  _, _, suit_values = _batch_tables()
+  return sum( suit_values[((masks >> np.uint64(13 * suit)) & np.uint64(RANK_MASK)).astype(np.int64)]
+              for suit in range(4) )
+
+def hands_to_mask_array(hands):
+  """ Convert an (N, 52) boolean array, or a sequence of N hand masks,
+  into an array of N hand masks """
+  import numpy as np
+  hands = np.asarray(hands)
+  if hands.ndim == 2:
+    bits = np.left_shift(np.uint64(1), np.arange(52, dtype=np.uint64))
+    return (hands.astype(np.uint64) * bits).sum(axis=1, dtype=np.uint64)
+  return hands.astype(np.uint64)
+
+def points_leftover_batch(hands, *, with_melds=False):
+  """ `points_leftover_mask` for many hands at once.
+
+  `hands` is either an (N, 52) boolean array indexed by card index, or N hand masks.
+  Returns an array of N deadwood point values. If `with_melds` is given, instead
+  returns (points, book masks, run masks), where the masks hold the cards of the
+  books and runs in each hand's best arrangement.
+
+  This works like `arrange_hand_mask_uncached`, with every hand stepping through
+  the choices of books in lock-step. Hands are grouped by how many ranks could
+  form books, since a hand with k such ranks has up to 6^k choices to try. """
+  import numpy as np
+  run_points, run_melded, _ = _batch_tables()
+
+  masks = hands_to_mask_array(hands)
+  n = len(masks)
+  points = np.zeros(n, dtype=np.int64)
+  books = np.zeros(n, dtype=np.uint64)
+  runs = np.zeros(n, dtype=np.uint64)
+
+  suit_shifts = [ np.uint64(13 * suit) for suit in range(4) ]
+  rank_mask = np.uint64(RANK_MASK)
+
+  # The cards of each rank, as (13, N) masks, and how many there are
+  columns = np.array([ masks & np.uint64(column) for column in RANK_COLUMNS ])
+  counts = np.zeros((13, n), dtype=np.int64)
+  for rank in range(13):
+    for shift in suit_shifts:
+      counts[rank] += ((masks >> (shift + np.uint64(rank))) & np.uint64(1)).astype(np.int64)
+  is_book_rank = counts >= 3
+  book_rank_counts = is_book_rank.sum(axis=0)
+
+  for k in np.unique(book_rank_counts):
+    group = np.nonzero(book_rank_counts == k)[0]
+    group_masks = masks[group]
+
+    # The ranks which could form a book, as (k, len(group)), and for each the
+    # choices: no book, the whole rank, or the whole rank less one suit
+    book_ranks = np.argsort(~is_book_rank[:, group], axis=0, kind='stable')[:k]
+    choices = []
+    for ranks in book_ranks:
+      whole = columns[ranks, group]
+      three = counts[ranks, group] == 3
+      slot_choices = [ np.zeros(len(group), dtype=np.uint64), whole ]
+      for shift in suit_shifts:
+        less_one = whole & ~(np.uint64(1) << (ranks.astype(np.uint64) + shift))
+        # Three cards less one is not a book
+        slot_choices.append(np.where(three, np.uint64(0), less_one))
+      choices.append(slot_choices)
+
+    best_points = None
+    for choice in it.product(range(6), repeat=k):
+      removed = np.zeros(len(group), dtype=np.uint64)
+      for slot_choices, option in zip(choices, choice):
+        removed |= slot_choices[option]
+      rest = group_masks & ~removed
+      choice_points = sum( run_points[((rest >> shift) & rank_mask).astype(np.int64)] for shift in suit_shifts )
+
+      if best_points is None:
+        best_points, best_removed = choice_points, removed
+      else:
+        better = choice_points < best_points
+        best_points = np.where(better, choice_points, best_points)
+        best_removed = np.where(better, removed, best_removed)
+
+    points[group] = best_points
+    if with_melds:
+      rest = group_masks & ~best_removed
+      books[group] = best_removed
+      for shift in suit_shifts:
+        runs[group] |= run_melded[((rest >> shift) & rank_mask).astype(np.int64)] << shift
+
+  if with_melds:
+    return points, books, runs
+  return points
+
+def score_hand_batch(our_hands, their_hands):
+  """ `score_hand_mask` for many pairs of hands, given as arrays of masks.
+
+  The hands are arranged by the (cached) solver one at a time, so that ties
+  between equally good arrangements break the same way as in `score_hand_mask`;
+  the layoffs and scoring are done for all the hands at once. """
+  import numpy as np
+  our_hands = hands_to_mask_array(our_hands)
+  their_hands = hands_to_mask_array(their_hands)
+
+  n = len(our_hands)
+  our_deadwood = np.zeros(n, dtype=np.uint64)
+  their_deadwood = np.zeros(n, dtype=np.uint64)
+  runs = np.zeros(n, dtype=np.uint64)
+  books = np.zeros(n, dtype=np.uint64)
+  for i, (our_hand, their_hand) in enumerate(zip(our_hands.tolist(), their_hands.tolist())):
+    our_melds, our_deadwood[i] = arrange_hand_mask(our_hand)
+    _, their_deadwood[i] = arrange_hand_mask(their_hand)
+    runs[i], books[i] = layoff_index_mask(our_melds)
+
+  is_gin = our_deadwood == 0
+
+  # As in layoffs_mask
+  one = np.uint64(1)
+  not_lowest, not_highest = np.uint64(NOT_LOWEST_RANKS), np.uint64(NOT_HIGHEST_RANKS)
+  reach = runs
+  while True:
+    grow = (((reach << one) & not_lowest) | ((reach >> one) & not_highest)) & their_deadwood & ~reach
+    if not grow.any():
+      break
+    reach = reach | grow
+  laid_off = np.where(is_gin, np.uint64(0), their_deadwood & (reach | books))
+  their_deadwood &= ~laid_off
+
+  our_points = mask_value_batch(our_deadwood)
+  their_points = mask_value_batch(their_deadwood)
+
+  undercut = their_points <= our_points
+  return np.where(
+    undercut,
+    -(our_points - their_points + UNDERCUT_BONUS),
+    their_points - our_points + np.where(is_gin, GIN_BONUS, 0),
+  )
+
+def play_hand(player1, player2, *, state_callback=lambda *state: None, rng=random):
   """
   Pit two players against each other in a single hand of Gin.
   Return an integer value V where:
@@ -178,10 +990,44 @@ def play_hand(player1, player2, *, state_callback=lambda x: None):
     5. If the game has not ended, this repeats for the next turn.
 
   The starting turn begins at step 2 instead of step 1.
+
+  The deck is shuffled with `rng`; pass a seeded random.Random to replay a hand.
+  """
+
+  steps = hand_steps(player1, player2, state_callback=state_callback, rng=rng)
+  response = None
+  while True:
+    try:
+      player, method, args = steps.send(response)
+    except StopIteration as stop:
+      return stop.value
+    response = getattr(player, method)(*args)
+
+async def play_hand_async(player1, player2, *, state_callback=lambda *state: None, rng=random):
+  """ Like `play_hand`, but the players' send, recv and send_and_recv may
+  be coroutines, which are awaited, so many hands can be played at once """
+
+  steps = hand_steps(player1, player2, state_callback=state_callback, rng=rng)
+  response = None
+  while True:
+    try:
+      player, method, args = steps.send(response)
+    except StopIteration as stop:
+      return stop.value
+    response = getattr(player, method)(*args)
+    if inspect.isawaitable(response):
+      response = await response
+
+def hand_steps(player1, player2, *, state_callback, rng):
+  """
+  The rules of a hand, without the talking to players, shared by `play_hand`
+  and `play_hand_async`. Yields (player, method, args) whenever a player
+  should be called as `getattr(player, method)(*args)`, and must be sent
+  what that returns. Returns the result of the hand, as `play_hand` does.
   """
 
-  deck = list(all_cards)
-  random.shuffle(deck)
+  deck = sorted(all_cards)
+  rng.shuffle(deck)
 
   # discard pile
   discard = []
@@ -191,8 +1037,8 @@ def play_hand(player1, player2, *, state_callback=lambda x: None):
   hand2 = { deck.pop() for _ in range(10) }
 
   # Send players their starting hand and starting turn info
-  player1.send('starting', hand1, True)
-  player2.send('starting', hand2, False)
+  yield (player1, 'send', ('starting', hand1, True))
+  yield (player2, 'send', ('starting', hand2, False))
 
   state_callback(hand1, hand2, history, discard)
 
@@ -217,7 +1063,7 @@ def play_hand(player1, player2, *, state_callback=lambda x: None):
     # Send the player the other player's turn
     if len(history) > 0:
       previous_turn = history[-1]
-      active_player.send('opponent_turn', previous_turn)
+      yield (active_player, 'send', ('opponent_turn', previous_turn))
 
       # If the other player's turn ended the game, end it now
       # We do this after sending the turn to the active player so that
@@ -236,10 +1082,10 @@ def play_hand(player1, player2, *, state_callback=lambda x: None):
         discard_top = discard.pop()
         deck = discard
         discard = [discard_top]
-        random.shuffle(deck)
+        rng.shuffle(deck)
 
     # Get where the player wants to draw from
-    draw_location = active_player.recv()
+    draw_location = yield (active_player, 'recv', ())
 
     if draw_location not in ['deck', 'discard']:
       raise ValueError(f"Draw location must be 'deck' or 'discard', not {repr(draw_location)}.")
@@ -253,7 +1099,7 @@ def play_hand(player1, player2, *, state_callback=lambda x: None):
 
     active_hand.add(drawn_card)
 
-    discard_choice, do_end = active_player.send_and_recv('drawn', drawn_card)
+    discard_choice, do_end = yield (active_player, 'send_and_recv', ('drawn', drawn_card))
 
     if discard_choice not in active_hand:
       raise ValueError(f"Cannot discard {discard_choice} since it's not in your hand.")
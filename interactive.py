@@ -6,7 +6,7 @@ Sample REPL code to use this module:
   >>> sys.path.append('bots/simple')
   >>> from simple_gin import simple_bot
   >>> import interactive
-  >>> interactive.play(simple_bot, bot_plays_first=True)
+  >>> interactive.play(simple_bot(), bot_plays_first=True)
 
 Of course, you can replace the simple bot with any bot
 """
@@ -148,7 +148,7 @@ if __name__ == '__main__':
   import sys
   sys.path.append('bots/simple')
   from simple_gin import simple_bot
-  play(simple_bot, bot_plays_first=True)
+  play(simple_bot(), bot_plays_first=True)
 
 
 
@@ -0,0 +1,227 @@
+"""
+Play many hands of gin at once, for tuning bots.
+
+`play_hands` advances a batch of independent hands in lock-step. The decks,
+hands and discard piles of all hands are held in NumPy arrays, so dealing,
+drawing, checking moves and scoring are done for the whole batch at once.
+Decisions are made by a policy: two functions which are each given a `Turns`
+holding the active player's view of every hand still being played.
+
+  choose_draws(turns)    -> array of bools, True to draw from the discard
+  choose_discards(turns) -> (array of card indices to discard, array of bools to end)
+
+A hand played by `play_hands` with some seed comes out exactly as
+`gin.play_hand(PolicyPlayer(...), PolicyPlayer(...), rng=random.Random(seed))`.
+"""
+
+import random
+import itertools as it
+
+import numpy as np
+
+import cards
+import gin
+from cards import Card, all_cards
+
+# The deck which `gin.play_hand` shuffles, as card indices
+DECK_ORDER = [ card.index for card in sorted(all_cards) ]
+
+CARD_VALUES = np.array([ card.value for card in cards.cards_by_index ], dtype=np.int64)
+
+def card_bits(indices):
+  """ The masks of an array of card indices """
+  return np.left_shift(np.uint64(1), np.asarray(indices).astype(np.uint64))
+
+def held_cards(hands, count):
+  """ The indices of the cards of each hand, which must all be `count` cards, as an (N, count) array, lowest first """
+  bits = (hands[:, None] >> np.arange(52, dtype=np.uint64)) & np.uint64(1)
+  return np.argsort(bits == 0, axis=1, kind='stable')[:, :count]
+
+class Turns:
+  """
+  What the active player of each hand knows at one decision, for a policy.
+
+    games:        the indices of the hands, within the batch
+    hands:        the active player's hand, as masks
+    discard_tops: the top of the discard pile, or -1 if it's empty; only for choose_draws
+    drawn:        the card just drawn; only for choose_discards
+  """
+
+  def __init__(self, games, hands, *, discard_tops=None, drawn=None):
+    self.games = games
+    self.hands = hands
+    self.discard_tops = discard_tops
+    self.drawn = drawn
+
+  def __len__(self):
+    return len(self.games)
+
+class LockstepHands:
+  """ A batch of hands, dealt from the given seeds, as `gin.play_hand` would deal them """
+
+  def __init__(self, seeds):
+    n = len(seeds)
+    self.rngs = [ random.Random(seed) for seed in seeds ]
+
+    # Decks and discard piles, bottom first, with how many cards are in each
+    self.decks = np.zeros((n, 52), dtype=np.int64)
+    self.deck_sizes = np.full(n, 52 - 20, dtype=np.int64)
+    self.discards = np.zeros((n, 52), dtype=np.int64)
+    self.discard_sizes = np.zeros(n, dtype=np.int64)
+
+    for game, rng in enumerate(self.rngs):
+      deck = list(DECK_ORDER)
+      rng.shuffle(deck)
+      self.decks[game] = deck
+
+    # Hands are dealt from the top of the deck, player 1 first
+    self.hands = np.zeros((n, 2), dtype=np.uint64)
+    self.hands[:, 0] = np.bitwise_or.reduce(card_bits(self.decks[:, 42:52]), axis=1)
+    self.hands[:, 1] = np.bitwise_or.reduce(card_bits(self.decks[:, 32:42]), axis=1)
+
+    # Whose turn it is, whether the hand is over, and its result as from play_hand
+    self.turns = np.zeros(n, dtype=np.int64)
+    self.ended = np.zeros(n, dtype=bool)
+    self.results = np.zeros(n, dtype=np.int64)
+
+  def reshuffle(self, game):
+    """ Turn the discard pile, less its top card, into the deck """
+    size = self.discard_sizes[game]
+    deck = self.discards[game, :size - 1].tolist()
+    self.rngs[game].shuffle(deck)
+    self.decks[game, :size - 1] = deck
+    self.deck_sizes[game] = size - 1
+    self.discards[game, 0] = self.discards[game, size - 1]
+    self.discard_sizes[game] = 1
+
+  def step(self, choose_draws, choose_discards):
+    """ Play one turn of every hand that hasn't ended """
+    games = np.nonzero(~self.ended)[0]
+    if len(games) == 0:
+      return
+
+    for game in games[self.deck_sizes[games] == 0]:
+      self.reshuffle(game)
+
+    players = self.turns[games]
+    hands = self.hands[games, players]
+    deck_sizes = self.deck_sizes[games]
+    discard_sizes = self.discard_sizes[games]
+
+    discard_tops = np.where(
+      discard_sizes > 0,
+      self.discards[games, np.maximum(discard_sizes - 1, 0)],
+      -1,
+    )
+
+    from_discard = np.asarray(choose_draws(Turns(games, hands, discard_tops=discard_tops)), dtype=bool)
+    if (from_discard & (discard_tops < 0)).any():
+      raise ValueError("Cannot draw from an empty discard pile.")
+
+    drawn = np.where(from_discard, discard_tops, self.decks[games, deck_sizes - 1])
+    self.deck_sizes[games] -= ~from_discard
+    discard_sizes -= from_discard
+    hands = hands | card_bits(drawn)
+
+    discard_choices, do_ends = choose_discards(Turns(games, hands, drawn=drawn))
+    discard_choices = np.asarray(discard_choices, dtype=np.int64)
+    do_ends = np.asarray(do_ends, dtype=bool)
+    if not ((hands >> discard_choices.astype(np.uint64)) & np.uint64(1)).all():
+      raise ValueError("Cannot discard a card which is not in the hand.")
+
+    hands ^= card_bits(discard_choices)
+    self.hands[games, players] = hands
+    self.discards[games, discard_sizes] = discard_choices
+    self.discard_sizes[games] = discard_sizes + 1
+
+    # The player who ended scores their hand against the other's
+    ending = games[do_ends]
+    if len(ending):
+      enders = self.turns[ending]
+      scores = gin.score_hand_batch(self.hands[ending, enders], self.hands[ending, 1 - enders])
+      self.results[ending] = np.where(enders == 0, scores, -scores)
+      self.ended[ending] = True
+
+    continuing = games[~do_ends]
+    self.turns[continuing] = 1 - self.turns[continuing]
+
+  def play(self, choose_draws, choose_discards, *, max_turns=None):
+    """ Play every hand to its end and return the results, as from `gin.play_hand`.
+
+    A policy can go around in circles forever; if `max_turns` is given, hands
+    which haven't ended after that many turns are given up on, with result 0. """
+    turns = it.count() if max_turns is None else range(max_turns)
+    for _ in turns:
+      if self.ended.all():
+        break
+      self.step(choose_draws, choose_discards)
+    return self.results
+
+def play_hands(choose_draws, choose_discards, seeds, *, max_turns=None):
+  """ Play a hand of the policy against itself for every seed, and return the results """
+  return LockstepHands(seeds).play(choose_draws, choose_discards, max_turns=max_turns)
+
+class PolicyPlayer:
+  """ A player for `gin.play_hand` which makes its decisions with a policy, one hand at a time """
+
+  def __init__(self, choose_draws, choose_discards):
+    self.choose_draws = choose_draws
+    self.choose_discards = choose_discards
+    self.hand = 0
+    self.discard_top = -1
+    self.response = None
+
+  def _turns(self, **kwargs):
+    return Turns(np.zeros(1, dtype=np.int64), np.array([self.hand], dtype=np.uint64), **kwargs)
+
+  def send(self, desc, *args):
+    if desc == 'starting':
+      hand, _ = args
+      self.hand = cards.hand_to_mask(hand)
+      self.discard_top = -1
+
+    elif desc == 'opponent_turn':
+      # Whatever they drew, what they discarded is now on top
+      (_, discard_choice, _), = args
+      self.discard_top = discard_choice.index
+
+    elif desc == 'drawn':
+      drawn_card, = args
+      self.hand |= cards.card_mask(drawn_card)
+      discard_choices, do_ends = self.choose_discards(self._turns(drawn=np.array([drawn_card.index])))
+      discard_choice = int(discard_choices[0])
+      self.hand ^= 1 << discard_choice
+      self.response = (Card.from_index(discard_choice), bool(do_ends[0]))
+
+    else:
+      assert False, f"Unrecognized message description {desc}"
+
+  def recv(self):
+    if self.response is not None:
+      response, self.response = self.response, None
+      return response
+    from_discard = self.choose_draws(self._turns(discard_tops=np.array([self.discard_top])))
+    return 'discard' if from_discard[0] else 'deck'
+
+  def send_and_recv(self, *args, **kwargs):
+    self.send(*args, **kwargs)
+    return self.recv()
+
+#= policies =#
+
+def greedy_draws(turns):
+  """ Draw from the discard when its top card would be melded """
+  has_top = turns.discard_tops >= 0
+  tops = np.maximum(turns.discard_tops, 0)
+  before = gin.points_leftover_batch(turns.hands)
+  after = gin.points_leftover_batch(turns.hands | card_bits(tops))
+  return has_top & (after < before + CARD_VALUES[tops])
+
+def greedy_discards(turns):
+  """ Discard to the least deadwood, preferring the lowest card on ties, and end whenever possible """
+  held = held_cards(turns.hands, 11)
+  remaining = turns.hands[:, None] ^ card_bits(held)
+  points = gin.points_leftover_batch(remaining.ravel()).reshape(remaining.shape)
+  best = points.argmin(axis=1)
+  rows = np.arange(len(held))
+  return held[rows, best], points[rows, best] <= gin.MAX_POINTS_TO_GO_DOWN
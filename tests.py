@@ -1,8 +1,27 @@
 from hypothesis import assume, given, errors, strategies as st
 from cards import Card, all_cards
+import cards
 from itertools import filterfalse
+from util import union, LRUCache
 import gin
+import random
 import unittest
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import pickle
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+import channels
+import client
+import simulate
+import tournament
+import wire
 
 Card = st.sampled_from(list(all_cards))
 Triple = st.frozensets(Card, min_size=3, max_size=3)
@@ -51,7 +70,26 @@ def go_down_hand(draw, cards=frozenset(all_cards)):
 
   return frozenset({*meld1, *meld2, *meld3, remaining_card})
 
+def lay_off(melds, deadwood):
+  """ Slow version of layoffs: keep laying off deadwood on melds until none fits.
+  Returns the remaining deadwood. """
+  melds = [ set(meld) for meld in melds ]
+  deadwood = set(deadwood)
+  laid_off = True
+  while laid_off:
+    laid_off = False
+    for card in sorted(deadwood):
+      fits = [ meld for meld in melds if gin.meldlike(meld | {card}) ]
+      for meld in fits:
+        meld.add(card)
+      if fits:
+        deadwood.remove(card)
+        laid_off = True
+  return frozenset(deadwood)
+
 Hand = st.frozensets(Card, min_size=10, max_size=10)
+# Hands drawn from few ranks have lots of overlapping melds
+MeldyHand = st.frozensets(st.sampled_from([ card for card in all_cards if card.rank <= 5 ]), min_size=10, max_size=11)
 
 class TestGameMethods(unittest.TestCase):
   @given(gin_hand(), Hand)
@@ -65,9 +103,11 @@ class TestGameMethods(unittest.TestCase):
   def test_score_go_down_hand(self, go_down_hand, other_hand):
     go_down_melds, go_down_deadwood = gin.arrange_hand(go_down_hand)
     go_down_points = gin.sum_cards_value(go_down_deadwood)
+    # The melds can come out so that the hand is gin after all
+    assume(len(go_down_deadwood) > 0)
     _, other_deadwood = gin.arrange_hand(other_hand)
     assume(len(other_deadwood) > 0)
-    other_unmatched_deadwood = frozenset(filterfalse(gin.extends_any_meld(go_down_melds), other_deadwood))
+    other_unmatched_deadwood = lay_off(go_down_melds, other_deadwood)
     other_points = gin.sum_cards_value(other_unmatched_deadwood)
     assume(other_points > go_down_points)
     if other_points > go_down_points:
@@ -77,5 +117,454 @@ class TestGameMethods(unittest.TestCase):
       expected_score = -10 - (go_down_points - other_points)
       self.assertEqual(expected_score, gin.score_hand(go_down_hand, other_hand))
 
+class TestBitmaskMethods(unittest.TestCase):
+  @given(Hand)
+  def test_mask_round_trip(self, hand):
+    mask = cards.hand_to_mask(hand)
+    self.assertEqual(set(hand), cards.mask_to_hand(mask))
+    self.assertEqual(mask, cards.mask_from_string(cards.mask_to_string(mask)))
+    self.assertEqual(mask, cards.mask_from_suit_masks(cards.suit_masks(mask)))
+
+  @given(Hand)
+  def test_melds_match_mask_melds(self, hand):
+    mask_melds = { frozenset(cards.mask_to_hand(meld)) for meld in gin.get_melds_mask(cards.hand_to_mask(hand)) }
+    self.assertEqual(gin.get_melds(hand), mask_melds)
+
+  @given(st.one_of(Hand, MeldyHand))
+  def test_arrange_hand_is_optimal(self, hand):
+    mask = cards.hand_to_mask(hand)
+    melds, deadwood = gin.arrange_hand_mask(mask)
+    _, reference_deadwood = gin.arrange_hand_mask_reference(mask)
+    self.assertEqual(gin.mask_value(reference_deadwood), gin.mask_value(deadwood))
+    self.assertFalse(gin.conflicting_masks(melds))
+    self.assertEqual(mask, deadwood | union(melds, 0))
+
+  @given(Hand, st.permutations(range(4)))
+  def test_canonical_form_ignores_suits(self, hand, permutation):
+    mask = cards.hand_to_mask(hand)
+    permuted = gin.permute_suits(mask, permutation)
+    self.assertEqual(mask, gin.unpermute_suits(permuted, permutation))
+    canonical, canonical_permutation = gin.canonicalize_hand(mask)
+    self.assertEqual(canonical, gin.canonicalize_hand(permuted)[0])
+    self.assertEqual(canonical, gin.permute_suits(mask, canonical_permutation))
+    self.assertEqual(gin.points_leftover_mask(mask), gin.points_leftover_mask(permuted))
+
+  @given(st.lists(st.one_of(Hand, MeldyHand), max_size=20))
+  def test_batch_matches_single(self, hands):
+    masks = list(map(cards.hand_to_mask, hands))
+    points, books, runs = gin.points_leftover_batch(masks, with_melds=True)
+    for mask, hand_points, hand_books, hand_runs in zip(masks, points, books, runs):
+      self.assertEqual(gin.points_leftover_mask(mask), hand_points)
+      self.assertEqual(0, int(hand_books) & int(hand_runs))
+      self.assertEqual(hand_points, gin.mask_value(mask & ~(int(hand_books) | int(hand_runs))))
+
+  @given(Hand, st.lists(Card, max_size=20))
+  def test_hand_state_tracks_deadwood(self, hand, toggles):
+    state = gin.HandState(hand)
+    hand = set(hand)
+    for card in toggles:
+      if card in hand:
+        self.assertEqual(gin.points_leftover(hand - {card}), state.points_without(card))
+        hand.remove(card)
+        state.remove(card)
+      else:
+        hand.add(card)
+        state.add(card)
+      self.assertEqual(gin.points_leftover(hand), state.points)
+      self.assertEqual(hand, set(state))
+
+  @given(st.one_of(Hand, MeldyHand), st.one_of(st.none(), Hand))
+  def test_evaluate_discards(self, hand, their_hand):
+    if their_hand is not None:
+      their_hand = their_hand - hand
+    evaluations = gin.evaluate_discards(hand, their_hand)
+    self.assertEqual(set(hand), set(evaluations))
+    for card in hand:
+      self.assertEqual(gin.points_leftover(hand - {card}, their_hand), evaluations[card])
+
+  @given(st.one_of(Hand, MeldyHand, gin_hand(), go_down_hand()))
+  def test_deadwood_bounds(self, hand):
+    mask = cards.hand_to_mask(hand)
+    lower, upper = gin.deadwood_bounds_mask(mask)
+    points = gin.points_leftover_mask(mask)
+    self.assertTrue(lower <= points <= upper)
+    if not any( sum( card.rank == rank for card in hand ) >= 3 for rank in range(1, 14) ):
+      self.assertEqual(lower, upper)
+    self.assertEqual(points <= gin.MAX_POINTS_TO_GO_DOWN, gin.can_end(hand))
+    self.assertEqual(points == 0, gin.is_gin(hand))
+
+  @given(st.one_of(gin_hand(), go_down_hand()), Hand)
+  def test_layoffs(self, hand, other_hand):
+    melds, _ = gin.arrange_hand(hand)
+    _, other_deadwood = gin.arrange_hand(other_hand)
+    self.assertEqual(other_deadwood - lay_off(melds, other_deadwood), gin.layoffs(melds, other_deadwood))
+
+  def test_chained_layoffs(self):
+    run = frozenset(map(cards.Card, ['C6', 'C7', 'C8']))
+    deadwood = set(map(cards.Card, ['C9', 'CX', 'CQ', 'C4']))
+    self.assertEqual(set(map(cards.Card, ['C9', 'CX'])), gin.layoffs([run], deadwood))
+
+class TestGameState(unittest.TestCase):
+  @given(st.randoms(), st.integers(min_value=1, max_value=6))
+  def test_apply_undo_round_trip(self, rng, depth):
+    deck = sorted(all_cards)
+    rng.shuffle(deck)
+    state = gin.GameState(cards.hand_to_mask(deck[:10]), cards.hand_to_mask(deck[10:20]), deck[20:21])
+    before = (list(state.hands), list(state.discard), state.discard_mask, state.turn)
+    for _ in range(depth):
+      moves = state.sample_moves(1, rng)
+      if state.ended or not moves: break
+      state.apply(moves[0])
+    while state._history:
+      state.undo()
+    self.assertEqual(before, (list(state.hands), list(state.discard), state.discard_mask, state.turn))
+    self.assertFalse(state.ended)
+
+  @given(gin_hand(), st.integers())
+  def test_sample_moves_are_legal(self, hand, seed):
+    rng = random.Random(seed)
+    rest = sorted(all_cards - hand)
+    rng.shuffle(rest)
+    state = gin.GameState(cards.hand_to_mask(rest[:10]), cards.hand_to_mask(hand), rest[10:12], turn=1)
+    moves = set(state.moves())
+    self.assertEqual(moves, set(state.sample_moves(len(moves) + 1, rng)))
+
+class TestInProcessBots(unittest.TestCase):
+  def test_play_hand_in_process(self):
+    bot1 = tournament.InProcessBot.load('random', Path('bots/random'))
+    bot2 = tournament.InProcessBot.load('simple', Path('bots/simple'))
+    for _ in range(5):
+      with bot1, bot2:
+        self.assertNotEqual(0, gin.play_hand(bot1, bot2))
+
+  def test_parallel_tournament_matches_serial(self):
+    bots = [ tournament.InProcessBot.load(name, Path(f"bots/{name}")) for name in ['simple', 'random', 'simple'] ]
+    with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(tournament, 'prettify_state', lambda *state: ''):
+      serial = tournament.do_tournament(bots, num_hands=4, seed='test')
+      parallel = tournament.do_tournament(bots, num_hands=4, seed='test', jobs=2)
+    self.assertEqual(list(serial.values()), list(parallel.values()))
+
+  def test_bots_sharing_a_name_get_their_own_deals(self):
+    bots = [ tournament.InProcessBot.load(name, Path(f"bots/{name}")) for name in ['simple', 'random', 'random'] ]
+    with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(tournament, 'prettify_state', lambda *state: ''):
+      results = list(tournament.do_tournament(bots, num_hands=4, seed='test').values())
+    # simple against each random
+    self.assertNotEqual(results[0], results[1])
+
+  def test_batch_bot_in_threads(self):
+    def choose_discards(states):
+      return [ max(hand, key=lambda card: (card.value, card)) for hand, _, _ in states ]
+
+    batch_bot = client.make_batch_bot(
+      lambda states: ['deck'] * len(states),
+      choose_discards,
+      lambda states: [True] * len(states),
+      max_batch_size=4,
+    )
+    new_simple = tournament.load_bot('simple', Path('bots/simple'))
+    results = []
+
+    def play(thread_number):
+      bot1 = tournament.InProcessBot('batch', batch_bot.bot)
+      bot2 = tournament.InProcessBot('simple', new_simple)
+      # Seeded, since some deals go on forever
+      for hand_number in range(3):
+        with bot1, bot2:
+          results.append(gin.play_hand(bot1, bot2, rng=random.Random(f"{thread_number}:{hand_number}")))
+
+    threads = [ threading.Thread(target=play, args=(thread_number,)) for thread_number in range(8) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    batch_bot.close()
+
+    self.assertEqual(24, len(results))
+    self.assertNotIn(0, results)
+    self.assertTrue(max(batch_bot.batcher.batch_sizes) > 1)
+    self.assertTrue(max(batch_bot.batcher.batch_sizes) <= 4)
+
+class TestBotProcesses(unittest.TestCase):
+  def test_multiplexed_batch_bot(self):
+    # A bot process made with play_bot(batch_bot) plays its hands on one
+    # thread; here the "process" is a thread of ours
+    def choose_discards(states):
+      # Not just the highest card, or a hand against itself may go on forever
+      return [ min(sorted(hand), key=gin.evaluate_discards(hand).get) for hand, _, _ in states ]
+
+    batch_bot = client.make_batch_bot(
+      lambda states: ['deck'] * len(states),
+      choose_discards,
+      lambda states: [True] * len(states),
+      max_batch_size=4,
+    )
+
+    class BotThread(threading.Thread):
+      def poll(self):
+        return None if self.is_alive() else 0
+
+    class ThreadedBot(tournament.MultiplexedGinBot):
+      def _spawn(self):
+        os.environ.update(GIN_CHANNEL_DIR=str(tournament.registry().directory), GIN_CHANNEL_ID=self.channel.id)
+        self.process = BotThread(target=client.play_bot, args=(batch_bot,))
+        self.process.start()
+
+    host = ThreadedBot('batch', Path('batch.sh'))
+
+    async def play_hands():
+      await host.start()
+      thread = host.process
+      try:
+        return await asyncio.gather(*( tournament.play_one_hand_async(host.new_hand(), host.new_hand(), f"test:{hand_number}")
+                                       for hand_number in range(8) ))
+      finally:
+        await host.shutdown()
+        thread.join()
+
+    loop = asyncio.new_event_loop()
+    try:
+      with mock.patch.dict(os.environ):
+        results = loop.run_until_complete(play_hands())
+    finally:
+      loop.close()
+    batch_bot.close()
+
+    self.assertNotIn(0, results)
+    self.assertTrue(max(batch_bot.batcher.batch_sizes) > 1)
+    self.assertTrue(max(batch_bot.batcher.batch_sizes) <= 4)
+
+  def test_protocol_versions_agree(self):
+    results = []
+    for options in [{ 'binary': False, 'v2': False }, { 'binary': False, 'v2': True }, { 'binary': True, 'v2': True }]:
+      bot1 = tournament.GinBot('random', Path('bots/random/random.sh'), **options)
+      bot2 = tournament.GinBot('simple', Path('bots/simple/simple.sh'), **options)
+      try:
+        results.append([ tournament.play_one_hand(bot1, bot2, f"test:{hand_number}") for hand_number in range(5) ])
+      finally:
+        bot1.shutdown()
+        bot2.shutdown()
+    self.assertEqual([results[0]] * 3, results)
+
+  def test_concurrent_tournament_matches_serial(self):
+    bots = [ tournament.GinBot(name, Path(f"bots/{name}/{name}.sh")) for name in ['random', 'simple'] ]
+    # Bot processes are given our stdout, so it has to be a real file
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), mock.patch.object(tournament, 'prettify_state', lambda *state: ''):
+      serial = tournament.do_tournament(bots, num_hands=3, seed='test')
+      multiplexed = tournament.do_tournament(bots, num_hands=3, seed='test', concurrency=3)
+      for bot in bots:
+        bot.multiplex = False
+      concurrent = tournament.do_tournament(bots, num_hands=3, seed='test', concurrency=3)
+      for bot in bots:
+        bot.binary = False
+      with mock.patch.object(wire.BinaryFormat, 'encode_message', side_effect=AssertionError("binary wasn't asked for")):
+        text = tournament.do_tournament(bots, num_hands=3, seed='test', concurrency=3)
+    self.assertEqual(list(serial.values()), list(multiplexed.values()))
+    self.assertEqual(list(serial.values()), list(concurrent.values()))
+    self.assertEqual(list(serial.values()), list(text.values()))
+
+  def test_concurrent_tournament_with_unmultiplexed_bot(self):
+    # A bot made with a generator plays one hand per process
+    gen_bot = f"""
+import sys
+sys.path.append({repr(os.path.abspath('.'))})
+sys.path.append({repr(os.path.abspath('bots/simple'))})
+import client
+import simple_gin
+client.play_bot(client.make_bot(simple_gin.choose_draw, simple_gin.choose_discard, simple_gin.should_end))
+"""
+    spawned = []
+    spawn = tournament.GinBot._spawn
+    def spawning(bot):
+      spawn(bot)
+      spawned.append((bot.name, bot.process))
+
+    with tempfile.TemporaryDirectory() as directory:
+      Path(directory, 'gen.sh').write_text('python3 gen_gin.py\n')
+      Path(directory, 'gen_gin.py').write_text(gen_bot)
+      bots = [ tournament.GinBot('gen', Path(directory, 'gen.sh')), tournament.GinBot('simple', Path('bots/simple/simple.sh')) ]
+      with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), mock.patch.object(tournament, 'prettify_state', lambda *state: ''):
+        serial = tournament.do_tournament(bots, num_hands=3, seed='test')
+        with mock.patch.object(tournament.GinBot, '_spawn', spawning):
+          concurrent = tournament.do_tournament(bots, num_hands=3, seed='test', concurrency=1)
+      gen_processes = [ process for name, process in spawned if name == 'gen' ]
+      # No process was started just to find out it can't be multiplexed,
+      # and each played its hand to the end
+      self.assertEqual(3, len(gen_processes))
+      self.assertEqual([0] * 3, [ process.wait() for process in gen_processes ])
+    self.assertEqual(list(serial.values()), list(concurrent.values()))
+
+class TestSimulate(unittest.TestCase):
+  def test_lockstep_hands_match_play_hand(self):
+    policy = (simulate.greedy_draws, simulate.greedy_discards)
+    seeds = list(range(30))
+    results = simulate.play_hands(*policy, seeds, max_turns=1000)
+    for seed, result in zip(seeds, results):
+      if result == 0: continue
+      expected = gin.play_hand(simulate.PolicyPlayer(*policy), simulate.PolicyPlayer(*policy), rng=random.Random(seed))
+      self.assertEqual(expected, result)
+
+  @given(st.lists(st.tuples(st.one_of(gin_hand(), go_down_hand(), Hand), Hand), max_size=10))
+  def test_score_hand_batch(self, pairs):
+    pairs = [ (ours, theirs - ours) for ours, theirs in pairs ]
+    ours = [ cards.hand_to_mask(hand) for hand, _ in pairs ]
+    theirs = [ cards.hand_to_mask(hand) for _, hand in pairs ]
+    expected = [ gin.score_hand(*pair) for pair in pairs ]
+    self.assertEqual(expected, list(gin.score_hand_batch(ours, theirs)))
+
+class TestChannelRegistry(unittest.TestCase):
+  def test_concurrent_channels_are_unique(self):
+    with tempfile.TemporaryDirectory() as directory:
+      # A leftover fifo from a process that's gone, and one from a live one
+      os.mkfifo(os.path.join(directory, 'channel_to_server_999999999-0-0.fifo'))
+      os.mkfifo(os.path.join(directory, f"channel_to_server_{os.getpid()}-0-0.fifo"))
+      registry = channels.ChannelRegistry(directory)
+      self.assertEqual([f"channel_to_server_{os.getpid()}-0-0.fifo"], os.listdir(directory))
+
+      opened = []
+      def open_channels():
+        for _ in range(20):
+          opened.append(registry.new_channel('test'))
+      threads = [ threading.Thread(target=open_channels) for _ in range(8) ]
+      for thread in threads: thread.start()
+      for thread in threads: thread.join()
+
+      self.assertEqual(160, len({ channel.id for channel in opened }))
+      for channel in opened:
+        channel.close()
+
+  def test_socket_errors_are_raised(self):
+    with tempfile.TemporaryDirectory() as directory, mock.patch.dict(os.environ, { 'GIN_TRANSPORT': 'socket' }):
+      # Too long for a socket address, which mustn't look like a taken id
+      registry = channels.ChannelRegistry(os.path.join(directory, 'x' * 120))
+      with self.assertRaises(OSError):
+        registry.new_channel('test')
+
+  def test_only_stale_registry_fifos_are_removed(self):
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    with tempfile.TemporaryDirectory() as directory:
+      ids = {
+        # made by the old client; might be in use
+        '12345678901234567890': True,
+        f"{os.getpid()}-0-0123abcd": True,
+        f"{dead.pid}-0-0123abcd": False,
+        '99999999999999999999-0-0123abcd': False,
+      }
+      for id in ids:
+        os.mkfifo(os.path.join(directory, f"channel_to_server_{id}.fifo"))
+      channels.ChannelRegistry(directory)
+      for id, kept in ids.items():
+        self.assertEqual(kept, os.path.exists(os.path.join(directory, f"channel_to_server_{id}.fifo")), id)
+
+  @given(st.lists(st.text(alphabet='abcXYZ0123:;,!+ é♥', max_size=200), min_size=1, max_size=5), st.sampled_from(['chunked', 'framed']), st.sampled_from(['fifo', 'socket']), st.booleans())
+  def test_channel_round_trip(self, messages, framing, transport, is_async):
+    with tempfile.TemporaryDirectory() as directory:
+      server_class = channels.AsyncChannel if is_async else channels.Channel
+      server = server_class('server', id='test', role=channels.Channel.SERVER, directory=directory, framing=framing, transport=transport)
+      client = channels.Channel('client', id='test', role=channels.Channel.CLIENT, directory=directory, framing=framing, transport=transport)
+      server.open()
+      client.open()
+      received = []
+      thread = threading.Thread(target=lambda: received.extend( client.send(message) or client.recv() for message in messages ))
+      thread.start()
+      if is_async:
+        async def echo():
+          for _ in messages:
+            await server.send(await server.recv())
+          # Its pipe transports close through the loop
+          server.close()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+          loop.run_until_complete(echo())
+        finally:
+          asyncio.set_event_loop(None)
+          loop.close()
+      else:
+        for _ in messages:
+          server.send(server.recv())
+        server.close()
+      thread.join()
+      client.close()
+    self.assertEqual(messages, received)
+
+class TestWire(unittest.TestCase):
+  @given(gin_hand(), st.booleans(), st.sampled_from(['deck', 'discard']), Card, st.booleans(), st.sampled_from(['text', 'binary']))
+  def test_messages_round_trip(self, hand, is_starting, draw_location, card, do_end, format_name):
+    wire_format = { 'text': wire.TEXT, 'binary': wire.BINARY }[format_name]
+    messages = [
+      ('starting', hand, is_starting),
+      ('opponent_turn', (draw_location, card, do_end)),
+      ('drawn', card),
+      ('new_hand', 'some:seed|3'),
+      ('new_hand', None),
+      ('quit',),
+    ]
+    for message in messages:
+      encoded = wire_format.encode_message(*message)
+      self.assertEqual((None, encoded), wire_format.untag(encoded))
+      self.assertEqual((12, encoded), wire_format.untag(wire_format.tag(12, encoded)))
+      self.assertEqual(message, wire_format.decode_message(encoded))
+    for response in [draw_location, (card, do_end), wire.DrawAndDiscard(card, do_end)]:
+      decoded = wire_format.decode_response(wire_format.encode_response(response))
+      self.assertEqual(response, decoded)
+      self.assertEqual(type(response), type(decoded))
+
+class TestCards(unittest.TestCase):
+  def test_cards_are_interned(self):
+    card = cards.Card('HX')
+    self.assertIs(card, cards.Card('h10'))
+    self.assertIs(card, cards.Card.from_index(card.index))
+    self.assertIs(card, pickle.loads(pickle.dumps(card)))
+    self.assertEqual(52, len({ cards.Card(str(card)) for card in all_cards }))
+
+class TestLRUCache(unittest.TestCase):
+  def test_eviction_and_stats(self):
+    cache = LRUCache(2)
+    square = lambda x: x * x
+    cache.get(1, square)
+    cache.get(2, square)
+    cache.get(1, square)
+    cache.get(3, square)  # evicts 2, the least recently used
+    self.assertEqual(9, cache.get(3, square))
+    self.assertEqual({ 'hits': 2, 'misses': 3, 'evictions': 1, 'size': 2, 'max_size': 2 }, cache.stats())
+    self.assertEqual(4, cache.get(2, lambda x: x * x))
+    self.assertEqual(2, cache.stats()['evictions'])
+
+  def test_concurrent_saves_keep_entries(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'cache.pickle')
+
+      def save_some(start):
+        cache = LRUCache(1000)
+        for key in range(start, start + 10):
+          cache.put(key, key)
+          cache.save(path)
+
+      processes = [ multiprocessing.get_context('fork').Process(target=save_some, args=(start,)) for start in range(0, 80, 10) ]
+      for process in processes: process.start()
+      for process in processes: process.join()
+
+      cache = LRUCache(1000)
+      cache.load(path)
+      self.assertEqual(set(range(80)), { key for key in range(80) if cache.get(key, lambda key: None) is not None })
+
+  def test_save_keeps_our_entries_and_skips_disabled(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'cache.pickle')
+      other = LRUCache(3)
+      for key in 'abc':
+        other.put(key, key)
+      other.save(path)
+
+      # Keys already in the file, which we used last, outlast the file's others
+      ours = LRUCache(3)
+      for key in 'ad':
+        ours.put(key, key)
+      ours.save(path)
+      LRUCache(0).save(path)
+
+      cache = LRUCache(3)
+      cache.load(path)
+      self.assertEqual(['c', 'a', 'd'], list(cache._entries))
+
 if __name__ == '__main__':
   unittest.main()
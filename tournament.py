@@ -5,103 +5,476 @@ import sys
 from pathlib import Path
 import itertools as it
 import statistics as stat
+import importlib.util
+import contextlib
+import multiprocessing
+import multiprocessing.util
+import tempfile
+import shutil
+import random
+import time
+import asyncio
+
+import client
 
-from cards import Card
 from channels import Channel
 import channels
 import gin
+import wire
 import prettify
 
-class GinBot:
-  def __init__(self, name, exec_loc):
+# Where this process makes the channels for its bots, made when first needed
+_registry = None
+
+def registry():
+  global _registry
+  if _registry is None:
+    _registry = channels.ChannelRegistry()
+  return _registry
+
+class PlannedDiscards:
+  """
+  For players of bot processes, which may speak protocol v2: a bot which
+  draws from the discard pile says what it'll discard in the same message.
+  play_hand still asks where to draw from and then sends the card drawn,
+  but that card isn't passed on to the bot, and the discard it already
+  said is given back.
+  """
+
+  # The (discard_choice, do_end) the bot said with drawing from the discard
+  planned = None
+
+  def _passes_on(self, desc):
+    """ Whether a message from play_hand is sent on to the bot """
+    return not (desc == 'drawn' and self.planned is not None)
+
+  def _take_plan(self):
+    planned, self.planned = self.planned, None
+    return planned
+
+  def _response(self, response):
+    """ The decoded response from the bot that play_hand wants now """
+    if isinstance(response, wire.DrawAndDiscard):
+      self.planned = (response.discard_choice, response.do_end)
+      return 'discard'
+    return response
+
+class GinBot(PlannedDiscards):
+  """
+  A bot run as its own process, which the server talks to over a channel,
+  of fifos or a socket as GIN_TRANSPORT says.
+
+  Bots which say so when registering are kept alive between hands: each hand
+  after the first starts with a 'new_hand' message, and the bot is sent 'quit'
+  on `shutdown`. If a kept-alive bot has died, it's started again. Other bots,
+  or all bots if `keep_alive` is False, get a fresh process every hand.
+
+  Likewise, messages are sent length-prefixed rather than in padded chunks
+  if the bot can, unless `framed` is False, and in binary rather than text
+  (see wire.py) if it can, unless `binary` is False; bots can plan their discards
+  (see PlannedDiscards) if they can, unless `v2` is False; and when played
+  concurrently, one process plays all of the bot's hands if it can, unless
+  `multiplex` is False.
+  """
+
+  def __init__(self, name, exec_loc, *, keep_alive=True, framed=True, binary=True, v2=True, multiplex=True):
     self.name = name
     self.exec_loc = exec_loc
+    self.keep_alive = keep_alive
+    self.framed = framed
+    self.binary = binary
+    self.v2 = v2
+    self.multiplex = multiplex
+    # Passed to the bot as GIN_SEED or with 'new_hand', if set
+    self.seed = None
+    self.process = None
+    self.channel = None
+    self.persistent = False
+    # How messages are written; see wire.py
+    self.wire_format = wire.TEXT
 
   def __str__(self):
     return self.name
 
   def __enter__(self):
-    client_name = self.exec_loc.stem
-
-    registration_channel = Channel(
-      name=f"client '{client_name}' registration",
-      id="gin_registration",
-      role=Channel.SERVER,
+    self.planned = None
+    if self.persistent and self.process.poll() is None:
+      self.send('new_hand', self.seed)
+    else:
+      if self.channel is not None:
+        # It died
+        self.channel.close()
+      self.start()
+
+  def start(self):
+    """ Start the bot process on a new channel and wait for it to register """
+    self.channel = registry().new_channel(f'server <-> {self.exec_loc.stem}')
+    self._spawn()
+
+    accepted = self._accept_registration(self.channel.recv())
+    self.channel.send('registered:' + ','.join(accepted))
+    self._use_capabilities(accepted)
+
+  def _spawn(self):
+    env = dict(
+      os.environ,
+      GIN_CHANNEL_DIR=str(registry().directory),
+      GIN_CHANNEL_ID=self.channel.id,
+      GIN_TRANSPORT=self.channel.transport,
     )
+    if self.seed is not None:
+      env['GIN_SEED'] = self.seed
 
-    registration_channel.open()
-
-    subprocess.Popen(
+    self.process = subprocess.Popen(
       ['sh', self.exec_loc.name],
       cwd=self.exec_loc.parent,
       stdout=sys.stdout,
+      env=env,
     )
 
-    channel_id = registration_channel.recv()
-
-    self.channel = Channel(
-      name=f'server <-> {client_name}',
-      id=channel_id,
-      role=Channel.SERVER,
-    )
-
-    self.channel.open()
-
-    registration_channel.send('fifos made')
-    registration_channel.close()
+  def _accept_registration(self, message):
+    """ The bot says what it can do, and we say what of that we'll use """
+    desc, capabilities = message.split(':', 1)
+    assert desc == 'register', f"Expected bot to register, not '{desc}'"
+    offered = capabilities.split(',')
+    wanted = self._wanted_capabilities()
+    if 'framed' not in offered:
+      # Binary messages need framing
+      wanted = [ capability for capability in wanted if capability != 'binary' ]
+    return [ capability for capability in offered if capability in wanted ]
+
+  def _wanted_capabilities(self):
+    wanted = []
+    if self.keep_alive:
+      wanted.append('persistent')
+    if self.framed:
+      wanted.append('framed')
+      if self.binary:
+        wanted.append('binary')
+    if self.v2:
+      wanted.append('v2')
+    return wanted
+
+  def _use_capabilities(self, accepted):
+    """ After the bot has been told what we accepted """
+    self.persistent = 'persistent' in accepted
+    if 'framed' in accepted:
+      self.channel.framing = Channel.FRAMED
+    if 'binary' in accepted:
+      self.channel.binary = True
+      self.wire_format = wire.BINARY
 
   def __exit__(self, exc_type, exc_value, traceback):
-    self.channel.close()
+    if exc_value is not None or not self.persistent:
+      # Don't keep a bot around that's in the middle of a hand
+      self.shutdown()
 
     if exc_value is not None:
       raise exc_value
 
-  def send_string(self, message: str):
-    self.channel.send(message)
+  def shutdown(self):
+    """ Tell a kept-alive bot to quit, and close the channel """
+    if self.channel is None:
+      return
+    if self.persistent and self.process.poll() is None:
+      try:
+        self.send('quit')
+      except BrokenPipeError:
+        pass
+    self.channel.close()
+    self.channel = None
+    self.process = None
+    self.persistent = False
+    self.wire_format = wire.TEXT
+
+  def forget_process(self):
+    """ Drop the bot process without telling it, as in a forked worker whose parent owns it """
+    self.channel = None
+    self.process = None
+    self.persistent = False
+    self.wire_format = wire.TEXT
 
   def send(self, desc, *args):
-    message_string = None
+    if self._passes_on(desc):
+      self.channel.send(self.wire_format.encode_message(desc, *args))
+
+  def recv(self):
+    if self.planned is not None:
+      return self._take_plan()
+    return self._response(self.wire_format.decode_response(self.channel.recv()))
+
+  def send_and_recv(self, *args, **kwargs):
+    self.send(*args, **kwargs)
+    return self.recv()
+
+class AsyncGinBot(GinBot):
+  """
+  A GinBot for `gin.play_hand_async`, which talks to its process with
+  coroutines, so that the server can wait on many bots at once.
+  It's used with `async with` rather than `with`.
+  """
+
+  async def __aenter__(self):
+    self.planned = None
+    if self.persistent and self.process.poll() is None:
+      await self.send('new_hand', self.seed)
+    else:
+      if self.channel is not None:
+        # It died
+        self.channel.close()
+      await self.start()
+
+  async def start(self):
+    """ Start the bot process on a new channel and wait for it to register """
+    self.channel = registry().new_channel(f'server <-> {self.exec_loc.stem}', channel_class=channels.AsyncChannel)
+    self._spawn()
+
+    accepted = self._accept_registration(await self.channel.recv())
+    await self.channel.send('registered:' + ','.join(accepted))
+    self._use_capabilities(accepted)
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    if exc_value is not None or not self.persistent:
+      await self.shutdown()
+
+  async def shutdown(self):
+    """ Tell a kept-alive bot to quit, and close the channel """
+    if self.channel is None:
+      return
+    if self.persistent and self.process.poll() is None:
+      try:
+        await self.send('quit')
+      except (BrokenPipeError, ConnectionResetError):
+        pass
+    self.channel.close()
+    self.channel = None
+    self.process = None
+    self.persistent = False
+    self.wire_format = wire.TEXT
+
+  async def send(self, desc, *args):
+    if self._passes_on(desc):
+      await self.channel.send(self.wire_format.encode_message(desc, *args))
+
+  async def recv(self):
+    if self.planned is not None:
+      return self._take_plan()
+    return self._response(self.wire_format.decode_response(await self.channel.recv()))
+
+  async def send_and_recv(self, *args, **kwargs):
+    await self.send(*args, **kwargs)
+    return await self.recv()
+
+class MultiplexedGinBot(AsyncGinBot):
+  """
+  A bot process which plays many hands at once, for `compete_concurrently`.
+  Each hand is played with its own `HostedHand`, from `new_hand`, rather
+  than with the bot itself. Messages to and from the process are tagged
+  with the id of their hand, and a task routes those from the process to
+  the hand they're for.
+
+  If the bot doesn't say it can be multiplexed when it registers,
+  `multiplexed` is False after `start` and it can't host hands. It plays
+  hands itself instead, like an AsyncGinBot, starting with the hand it was
+  started for: its first `async with` uses the process as it is.
+  """
+
+  def __init__(self, name, exec_loc, **kwargs):
+    super().__init__(name, exec_loc, **kwargs)
+    self.multiplexed = False
+    # Messages from the process, for each hand being played
+    self.inboxes = {}
+    self.game_ids = it.count()
+    self.router = None
+    self.send_lock = None
+    # Whether it's been started but hasn't played a hand itself yet
+    self.unplayed = False
+
+  async def __aenter__(self):
+    if self.unplayed:
+      self.unplayed = False
+      self.planned = None
+      return
+    await super().__aenter__()
+
+  def _wanted_capabilities(self):
+    # A multiplexed bot is also kept alive, so that it can be told to quit
+    return super()._wanted_capabilities() + ['persistent', 'multiplexed']
+
+  def _use_capabilities(self, accepted):
+    super()._use_capabilities(accepted)
+    self.multiplexed = 'multiplexed' in accepted
+    self.unplayed = not self.multiplexed
+    if self.multiplexed:
+      self.send_lock = asyncio.Lock()
+      self.router = asyncio.ensure_future(self._route())
+
+  async def _route(self):
+    try:
+      while True:
+        game, message = self.wire_format.untag(await self.channel.recv())
+        self.inboxes[game].put_nowait(message)
+    except Exception as error:
+      # The process died; let the hands waiting on it know
+      for inbox in self.inboxes.values():
+        inbox.put_nowait(error)
+
+  def new_hand(self):
+    return HostedHand(self, next(self.game_ids))
+
+  async def send_to(self, game, desc, *args):
+    async with self.send_lock:
+      await self.channel.send(self.wire_format.tag(game, self.wire_format.encode_message(desc, *args)))
+
+  async def shutdown(self):
+    if self.router is not None:
+      self.router.cancel()
+      self.router = None
+    self.multiplexed = False
+    self.unplayed = False
+    await super().shutdown()
+
+class HostedHand(PlannedDiscards):
+  """ A player for `gin.play_hand_async` which plays a hand on a MultiplexedGinBot """
+
+  def __init__(self, host, game):
+    self.host = host
+    self.game = game
+    self.seed = None
+
+  def __str__(self):
+    return str(self.host)
+
+  async def __aenter__(self):
+    self.host.inboxes[self.game] = asyncio.Queue()
+    await self.host.send_to(self.game, 'new_hand', self.seed)
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    del self.host.inboxes[self.game]
+
+  async def send(self, desc, *args):
+    if self._passes_on(desc):
+      await self.host.send_to(self.game, desc, *args)
+
+  async def recv(self):
+    if self.planned is not None:
+      return self._take_plan()
+    message = await self.host.inboxes[self.game].get()
+    if isinstance(message, Exception):
+      raise message
+    return self._response(self.host.wire_format.decode_response(message))
+
+  async def send_and_recv(self, *args, **kwargs):
+    await self.send(*args, **kwargs)
+    return await self.recv()
+
+@contextlib.contextmanager
+def in_directory(path):
+  previous = os.getcwd()
+  os.chdir(path)
+  try:
+    yield
+  finally:
+    os.chdir(previous)
+
+def load_bot(name, bot_dir):
+  """ Import the Python module of a bot made with `client.make_bot` or
+  `client.make_batch_bot`, and return a function which makes a fresh bot """
+  function_names = ['choose_draw', 'choose_discard', 'should_end']
+
+  for module_path in sorted(bot_dir.glob('*.py')):
+    # Absolute, since Python 3.6 only opens the file once we're in the bot's directory
+    spec = importlib.util.spec_from_file_location(f"gin_bot_{name}_{module_path.stem}", module_path.resolve())
+    module = importlib.util.module_from_spec(spec)
+    # Import from the bot's directory, as `sh bot.sh` would run it
+    with in_directory(bot_dir):
+      spec.loader.exec_module(module)
+
+    batch_bots = [ value for value in vars(module).values() if isinstance(value, client.BatchBot) ]
+    if batch_bots:
+      return batch_bots[0].bot
+
+    if all( hasattr(module, function_name) for function_name in function_names ):
+      functions = tuple( getattr(module, function_name) for function_name in function_names )
+      return lambda: client.make_bot(*functions)
+
+  raise ValueError(f"Bot '{name}' has no Python module defining {', '.join(function_names)} or a batch bot.")
+
+class InProcessBot:
+  """
+  A player like GinBot, but which runs a bot made with `client.make_bot`
+  in this process rather than talking to it over a channel. Each hand gets a
+  fresh bot from `new_bot`, like each hand gets a fresh process with GinBot.
+  """
+
+  def __init__(self, name, new_bot):
+    self.name = name
+    self.new_bot = new_bot
+    self.bot = None
+    # If set, seeds `random` at the start of each hand
+    self.seed = None
+    self.bot_dir = None
+
+  @classmethod
+  def load(cls, name, bot_dir):
+    bot = cls(name, load_bot(name, bot_dir))
+    bot.bot_dir = bot_dir
+    return bot
+
+  def __reduce__(self):
+    # Send loaded bots to worker processes by where to load them from
+    if self.bot_dir is None:
+      raise TypeError("Only bots made with InProcessBot.load can be pickled.")
+    return (InProcessBot.load, (self.name, self.bot_dir))
+
+  def __str__(self):
+    return self.name
 
+  def __enter__(self):
+    if self.seed is not None:
+      random.seed(self.seed)
+    self.bot = self.new_bot()
+    # The response to the last message, if it had one
+    self.response = None
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.bot.close()
+    self.bot = None
+
+  def shutdown(self):
+    pass
+
+  def forget_process(self):
+    pass
+
+  def send(self, desc, *args):
+    # This does what client.play_bot_with_channels does with messages from the server
     if desc == 'starting':
-      # Start of the game
       hand, is_starting = args
-      hand_str = ','.join(map(str, hand))
-      starting_str = { True: 'you start', False: 'opponent starts' }[is_starting]
-      message_string = f"starting:{hand_str};{starting_str}"
+      next(self.bot)
+      self.bot.send((set(hand), is_starting))
 
     elif desc == 'opponent_turn':
-      # The opponent played; this was their turn
       opponent_turn, = args
-      draw_location, discard_choice, do_end = opponent_turn
-      end_str = { True: 'end', False: 'continue' }[do_end]
-      message_string = f"opponent_turn:{draw_location};{discard_choice};{end_str}"
+      _, _, do_end = opponent_turn
+      if not do_end:
+        next(self.bot)
+        self.bot.send(opponent_turn)
 
     elif desc == 'drawn':
-      # This is the card that the agent drew
       drawn_card, = args
-      message_string = f"drawn:{drawn_card}"
+      self.response = self.bot.send(drawn_card)
 
     else:
       assert False, f"Unrecognized message description {desc}"
 
-    self.send_string(message_string)
-
   def recv(self):
-    message_string = self.channel.recv()
-    desc, payload = message_string.split(':')
-
-    if desc == 'draw_from':
-      assert payload in ['deck', 'discard']
-      return payload
-
-    elif desc == 'discard':
-      discard_choice, do_end = payload.split(';')
-      discard_choice = Card(discard_choice)
-      do_end = { 'True': True, 'False': False }[do_end]
-      return (discard_choice, do_end)
-
-    else:
-      assert False, f"Unrecognized message description {desc}"
+    if self.response is not None:
+      # The (discard_choice, do_end) to the card we drew
+      response, self.response = self.response, None
+      return response
+    # Where to draw from
+    return next(self.bot)
 
   def send_and_recv(self, *args, **kwargs):
     self.send(*args, **kwargs)
@@ -112,8 +485,34 @@ def print_state(hand1, hand2, history, discard):
   pretty = prettify_state(hand1, hand2, history, discard)
   print(pretty, end='')
 
-def compete(bot1, bot2, num_hands=15):
-  """ pit two bots against each other """
+def hand_seed(seed, bot1, bot2, hand_number, indices):
+  """ The seed of a single hand of a tournament, which doesn't depend on where or when it's played.
+  `indices` are where the bots are in the tournament's list of bots, which tells apart bots with the same name. """
+  if seed is None:
+    return None
+  index1, index2 = indices
+  return f"{seed}:{index1}.{bot1}:{index2}.{bot2}:{hand_number}"
+
+def bot_seed(seed, player):
+  """ The seed of the bot playing as player 1 or 2 in a hand with the given seed """
+  if seed is None:
+    return None
+  return f"{seed}:{player}"
+
+def play_one_hand(bot1, bot2, seed=None, *, state_callback=lambda *state: None):
+  """ Play a hand between two bots. If a seed is given, the deck and the bots are seeded from it. """
+  if seed is None:
+    rng = random
+  else:
+    rng = random.Random(seed)
+    bot1.seed = bot_seed(seed, 1)
+    bot2.seed = bot_seed(seed, 2)
+
+  with bot1, bot2:
+    return gin.play_hand(bot1, bot2, state_callback=state_callback, rng=rng)
+
+def compete(bot1, bot2, num_hands=15, *, seed=None, indices=(0, 1)):
+  """ pit two bots against each other; `indices` are as for `hand_seed` """
 
   print(f"\n#= {bot1} vs {bot2} =#")
 
@@ -128,8 +527,7 @@ def compete(bot1, bot2, num_hands=15):
   for i in range_it:
     print(f"Hand #{i + 1}/{num_hands}... ", end='', flush=True)
 
-    with bot1, bot2:
-      result = gin.play_hand(bot1, bot2, state_callback=print_state)
+    result = play_one_hand(bot1, bot2, hand_seed(seed, bot1, bot2, i, indices), state_callback=print_state)
 
     assert result != 0, "Something is wrong"
 
@@ -145,15 +543,179 @@ def compete(bot1, bot2, num_hands=15):
 
   return scores
 
-def do_tournament(bots, num_hands=15):
+def do_tournament(bots, num_hands=15, *, seed=None, jobs=1, concurrency=None):
   """ for a list of bots, pit each bot against every other """
 
   # Pit every bot against each other
   matches = list(it.combinations(bots, 2))
-  match_results = { match: compete(*match, num_hands=num_hands)
-                    for match
-                    in matches }
+  indices = { id(bot): index for index, bot in enumerate(bots) }
+  if concurrency is not None:
+    if jobs > 1:
+      raise ValueError("Hands are played either over processes or concurrently, not both.")
+    # Not asyncio.run, which needs Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+      match_results = loop.run_until_complete(compete_concurrently(bots, matches, num_hands, seed=seed, concurrency=concurrency))
+    finally:
+      loop.close()
+  elif jobs > 1:
+    match_results = compete_in_parallel(bots, matches, num_hands, seed=seed, jobs=jobs)
+  else:
+    try:
+      match_results = { match: compete(*match, num_hands=num_hands, seed=seed, indices=tuple( indices[id(bot)] for bot in match ))
+                        for match
+                        in matches }
+    finally:
+      for bot in bots:
+        bot.shutdown()
   print_scoreboard(match_results)
+  return match_results
+
+#= parallel tournaments =#
+
+# In a worker process, its own copies of the tournament's bots
+worker_bots = None
+
+def start_worker(bots):
+  global worker_bots
+  worker_bots = bots
+  for bot in bots:
+    bot.forget_process()
+  # Let kept-alive bots go when the worker exits
+  multiprocessing.util.Finalize(None, stop_worker, exitpriority=10)
+
+def stop_worker():
+  for bot in worker_bots:
+    bot.shutdown()
+
+def play_worker_hand(task):
+  """ Play one hand, as (match index, bot indices, hand number, seed), in a worker """
+  match_index, (index1, index2), hand_number, seed = task
+  bot1, bot2 = worker_bots[index1], worker_bots[index2]
+  result = play_one_hand(bot1, bot2, hand_seed(seed, bot1, bot2, hand_number, (index1, index2)))
+  return match_index, hand_number, result
+
+def compete_in_parallel(bots, matches, num_hands, *, seed, jobs):
+  """ Play the hands of all matches over a pool of `jobs` processes.
+  The results are as from `compete`, in the same order. """
+  if num_hands == 0:
+    raise ValueError("Can't play infinitely many hands in parallel.")
+
+  indices = { id(bot): index for index, bot in enumerate(bots) }
+  tasks = [ (match_index, (indices[id(bot1)], indices[id(bot2)]), hand_number, seed)
+            for match_index, (bot1, bot2) in enumerate(matches)
+            for hand_number in range(num_hands) ]
+  scores = [ [None] * num_hands for _ in matches ]
+
+  start = time.monotonic()
+  with multiprocessing.Pool(jobs, initializer=start_worker, initargs=(bots,)) as pool:
+    for done, (match_index, hand_number, result) in enumerate(pool.imap_unordered(play_worker_hand, tasks), 1):
+      assert result != 0, "Something is wrong"
+      scores[match_index][hand_number] = result
+      elapsed = time.monotonic() - start
+      print(f"\r{done}/{len(tasks)} hands played over {jobs} jobs in {elapsed:.1f}s", end='', flush=True)
+    # Rather than terminating the workers, so that they shut their bots down
+    pool.close()
+    pool.join()
+  print()
+
+  return dict(zip(matches, scores))
+
+#= concurrent tournaments =#
+
+async def play_one_hand_async(bot1, bot2, seed=None, *, state_callback=lambda *state: None):
+  """ Like `play_one_hand`, for AsyncGinBots """
+  if seed is None:
+    rng = random
+  else:
+    rng = random.Random(seed)
+    bot1.seed = bot_seed(seed, 1)
+    bot2.seed = bot_seed(seed, 2)
+
+  async with bot1, bot2:
+    return await gin.play_hand_async(bot1, bot2, state_callback=state_callback, rng=rng)
+
+async def compete_concurrently(bots, matches, num_hands, *, seed, concurrency):
+  """ Play the hands of all matches from this process, up to `concurrency`
+  at once, over asyncio. The results are as from `compete`, in the same order. """
+  if num_hands == 0:
+    raise ValueError("Can't play infinitely many hands concurrently.")
+  if not all( isinstance(bot, GinBot) for bot in bots ):
+    # They'd share this process's `random`, so seeded hands wouldn't replay
+    raise ValueError("Only bot processes can play concurrently, not in-process bots.")
+
+  indices = { id(bot): index for index, bot in enumerate(bots) }
+
+  # Bots which can be multiplexed play all their hands in one process.
+  # Which can is found out from the first process started for each bot.
+  hosts = {}
+  started = []
+  probing = { id(bot): asyncio.Lock() for bot in bots if bot.multiplex }
+
+  # Otherwise a bot process plays one hand at a time, so every hand being
+  # played needs its own; they're kept between hands, like GinBots are
+  idle = { id(bot): [] for bot in bots }
+
+  async def borrow(bot, seed):
+    """ A player of the bot for a hand, in which it's seeded with `seed` """
+    if id(bot) in probing:
+      async with probing[id(bot)]:
+        if id(bot) in probing:
+          del probing[id(bot)]
+          probe = MultiplexedGinBot(bot.name, bot.exec_loc, keep_alive=bot.keep_alive, framed=bot.framed, binary=bot.binary, v2=bot.v2)
+          # In case it plays this hand itself, as a fresh process would
+          probe.seed = seed
+          started.append(probe)
+          await probe.start()
+          if not probe.multiplexed:
+            return probe
+          hosts[id(bot)] = probe
+
+    if id(bot) in hosts:
+      return hosts[id(bot)].new_hand()
+    if idle[id(bot)]:
+      return idle[id(bot)].pop()
+    copy = AsyncGinBot(bot.name, bot.exec_loc, keep_alive=bot.keep_alive, framed=bot.framed, binary=bot.binary, v2=bot.v2)
+    started.append(copy)
+    return copy
+
+  def give_back(bot, copy):
+    if id(bot) not in hosts:
+      idle[id(bot)].append(copy)
+
+  semaphore = asyncio.Semaphore(concurrency)
+  scores = [ [None] * num_hands for _ in matches ]
+  done = 0
+  total = len(matches) * num_hands
+  start = time.monotonic()
+
+  async def play(match_index, bot1, bot2, hand_number):
+    nonlocal done
+    async with semaphore:
+      this_hand_seed = hand_seed(seed, bot1, bot2, hand_number, (indices[id(bot1)], indices[id(bot2)]))
+      copy1 = await borrow(bot1, bot_seed(this_hand_seed, 1))
+      copy2 = await borrow(bot2, bot_seed(this_hand_seed, 2))
+      try:
+        result = await play_one_hand_async(copy1, copy2, this_hand_seed)
+      finally:
+        give_back(bot1, copy1)
+        give_back(bot2, copy2)
+
+    assert result != 0, "Something is wrong"
+    scores[match_index][hand_number] = result
+    done += 1
+    elapsed = time.monotonic() - start
+    print(f"\r{done}/{total} hands played, up to {concurrency} at once, in {elapsed:.1f}s", end='', flush=True)
+
+  try:
+    await asyncio.gather(*( play(match_index, bot1, bot2, hand_number)
+                            for match_index, (bot1, bot2) in enumerate(matches)
+                            for hand_number in range(num_hands) ))
+  finally:
+    await asyncio.gather(*( bot.shutdown() for bot in started ))
+  print()
+
+  return dict(zip(matches, scores))
 
 def print_scoreboard(match_results):
   print("\n\n#== Scoreboard ==#")
@@ -177,6 +739,34 @@ parser.add_argument(
   '-n', '--num_hands', type=int, default=15,
   help='the number of hands of play per match, defaults to 15, 0 means infinite'
 )
+parser.add_argument(
+  '-j', '--jobs', type=int, default=1,
+  help='play hands in parallel over this many processes'
+)
+parser.add_argument(
+  '-c', '--concurrency', type=int, default=None, metavar='N',
+  help='play up to N hands at once from this process, waiting on the bot processes with asyncio'
+)
+parser.add_argument(
+  '--seed', type=str, default=None,
+  help='seed every hand, and the bots playing it, so that a tournament can be replayed, in parallel or not'
+)
+parser.add_argument(
+  '--channel-dir', type=str, default=None, metavar='DIR',
+  help="where to make the bots' fifos or sockets; defaults to a fresh directory under /tmp/gin for each tournament"
+)
+parser.add_argument(
+  '--transport', choices=['fifo', 'socket'], default=None,
+  help='talk to bot processes over fifos or Unix domain sockets; defaults to GIN_TRANSPORT, else fifos'
+)
+parser.add_argument(
+  '--in-process', action='append', default=[], metavar='NAME',
+  help='run the named Python bot in the server process instead of over fifos or a socket; may be repeated, "all" means every bot'
+)
+parser.add_argument(
+  '--arrangement-cache', type=str, default=None, metavar='PATH',
+  help='persist the hand arrangement cache of the server and bots in this file between runs'
+)
 parser.add_argument(
   '-s', '--style', type=str, default='none',
   help='Choose the style, "tabletop" or "grid" or "none". Default: "none"'
@@ -207,6 +797,31 @@ if __name__ == '__main__':
     if not os.path.exists(bot_path):
       print(f"No known bot named '{bot_name}'.")
       sys.exit(1)
-    bots.append(GinBot(bot_name, bot_path))
+    if bot_name in args.in_process or 'all' in args.in_process:
+      bots.append(InProcessBot.load(bot_name, bot_path.parent))
+    else:
+      bots.append(GinBot(bot_name, bot_path))
+
+  if args.arrangement_cache:
+    # Bots inherit the environment, so they pick this up in client.play_bot
+    cache_path = os.path.abspath(args.arrangement_cache)
+    os.environ['GIN_ARRANGEMENT_CACHE'] = cache_path
+    gin.load_arrangement_cache(cache_path)
+
+  # Bots, and workers, inherit the environment, so they pick these up
+  if args.transport:
+    os.environ['GIN_TRANSPORT'] = args.transport
+  if args.channel_dir:
+    os.environ['GIN_CHANNEL_DIR'] = os.path.abspath(args.channel_dir)
+  else:
+    Path('/tmp/gin').mkdir(parents=True, exist_ok=True)
+    os.environ['GIN_CHANNEL_DIR'] = tempfile.mkdtemp(prefix='tournament-', dir='/tmp/gin')
+
+  try:
+    do_tournament(bots, num_hands=args.num_hands, seed=args.seed, jobs=args.jobs, concurrency=args.concurrency)
+  finally:
+    if not args.channel_dir:
+      shutil.rmtree(os.environ['GIN_CHANNEL_DIR'], ignore_errors=True)
 
-  do_tournament(bots, num_hands=args.num_hands)
+  if args.arrangement_cache:
+    gin.save_arrangement_cache(cache_path)
@@ -1,4 +1,9 @@
+import fcntl
 import itertools
+import os
+import pickle
+import threading
+from collections import OrderedDict
 
 def powerset(iterable):
     # https://docs.python.org/3.6/library/itertools.html#itertools-recipes
@@ -30,3 +35,100 @@ def input_until(string, predicate, *, error="What? Try again."):
       return val
     else:
       print(error)
+
+def popcount(n):
+  "Number of set bits in a non-negative integer"
+  return bin(n).count('1')
+
+class LRUCache:
+  """ A mapping of at most `max_size` entries which forgets the least recently used
+  entry when full, and counts its hits, misses and evictions.
+  A `max_size` of 0 disables caching. """
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key, compute):
+    """ Return the value for `key`, calling `compute(key)` and storing its result if absent """
+    with self._lock:
+      if key in self._entries:
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+      self.misses += 1
+
+    value = compute(key)
+    self.put(key, value)
+    return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._entries[key] = value
+      self._entries.move_to_end(key)
+      self._evict()
+
+  def _evict(self):
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+
+  def resize(self, max_size):
+    with self._lock:
+      self.max_size = max_size
+      self._evict()
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.hits = self.misses = self.evictions = 0
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'size': len(self._entries),
+      'max_size': self.max_size,
+    }
+
+  def save(self, path):
+    """ Write the entries to disk, merged with any entries already saved there,
+    so that several processes can share one file. Our entries count as the
+    most recently used. A disabled cache leaves the file alone. """
+    if not self.max_size:
+      return
+    # Hold a lock on a file beside it while merging, or two processes saving
+    # at once would each drop the other's new entries
+    with open(f"{path}.lock", 'a') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      merged = OrderedDict(_read_entries(path))
+      with self._lock:
+        for key, value in self._entries.items():
+          merged[key] = value
+          merged.move_to_end(key)
+      entries = list(merged.items())[-self.max_size:]
+
+      temp_path = f"{path}.{os.getpid()}.tmp"
+      with open(temp_path, 'wb') as file:
+        pickle.dump(entries, file)
+      # Replace atomically so that concurrent readers never see a partial file
+      os.replace(temp_path, path)
+
+  def load(self, path):
+    """ Warm the cache with entries saved by `save`. Missing files are ignored. """
+    for key, value in _read_entries(path):
+      self.put(key, value)
+
+def _read_entries(path):
+  if not os.path.exists(path):
+    return []
+  with open(path, 'rb') as file:
+    return pickle.load(file)
@@ -0,0 +1,236 @@
+"""
+How the messages between the server and bot processes are written.
+
+Both ends talk in terms of decoded messages. The server sends the bot
+
+  ('starting', hand, is_starting)
+  ('opponent_turn', (draw_location, discard_choice, do_end))
+  ('drawn', drawn_card)
+  ('new_hand', seed)        # seed may be None
+  ('quit',)
+
+and the bot answers with what play_hand wants back from a player: 'deck' or
+'discard', a (discard_choice, do_end) pair, or a DrawAndDiscard.
+
+TEXT writes these as strings like 'drawn:H4'. BINARY, which both ends must
+agree to when the bot registers and which needs a framed channel, writes
+them as bytes: a header byte holding the kind of message and its flags,
+then one byte per card, so a starting hand is 11 bytes and a move is 2.
+In a multiplexed channel, messages are tagged with the id of their hand.
+"""
+
+import struct
+import collections
+
+from cards import Card, cards_by_index
+
+# A bot drew from the discard pile and will discard this, saying so in the
+# same message, in protocol v2
+DrawAndDiscard = collections.namedtuple('DrawAndDiscard', ['discard_choice', 'do_end'])
+
+class TextFormat:
+  """ Messages as strings like 'opponent_turn:deck;H4;continue' """
+
+  def encode_message(self, desc, *args):
+    """ A message from the server """
+    if desc == 'starting':
+      # Start of the game
+      hand, is_starting = args
+      hand_str = ','.join(map(str, hand))
+      starting_str = { True: 'you start', False: 'opponent starts' }[is_starting]
+      return f"starting:{hand_str};{starting_str}"
+
+    elif desc == 'opponent_turn':
+      # The opponent played; this was their turn
+      opponent_turn, = args
+      draw_location, discard_choice, do_end = opponent_turn
+      end_str = { True: 'end', False: 'continue' }[do_end]
+      return f"opponent_turn:{draw_location};{discard_choice};{end_str}"
+
+    elif desc == 'drawn':
+      # This is the card that the agent drew
+      drawn_card, = args
+      return f"drawn:{drawn_card}"
+
+    elif desc == 'new_hand':
+      seed, = args
+      return f"new_hand:{seed or ''}"
+
+    elif desc == 'quit':
+      return 'quit:'
+
+    else:
+      assert False, f"Unrecognized message description {desc}"
+
+  def decode_message(self, message):
+    desc, payload = message.split(':', 1)
+
+    if desc == 'starting':
+      starting_hand, who_starts = payload.split(';')
+      starting_hand = set(map(Card, starting_hand.split(',')))
+      am_starting = { 'you start': True, 'opponent starts': False }[who_starts]
+      return (desc, starting_hand, am_starting)
+
+    elif desc == 'opponent_turn':
+      draw_location, discard_choice, end_str = payload.split(';')
+      do_end = { 'end': True, 'continue': False }[end_str]
+      return (desc, (draw_location, Card(discard_choice), do_end))
+
+    elif desc == 'drawn':
+      return (desc, Card(payload))
+
+    elif desc == 'new_hand':
+      return (desc, payload or None)
+
+    elif desc == 'quit':
+      return (desc,)
+
+    else:
+      assert False, f"Unrecognized message description {desc}"
+
+  def encode_response(self, response):
+    """ A response from the bot """
+    if isinstance(response, DrawAndDiscard):
+      return f"draw_discard:{response.discard_choice};{response.do_end}"
+    elif isinstance(response, tuple):
+      discard_choice, do_end = response
+      return f"discard:{discard_choice};{do_end}"
+    else:
+      return f"draw_from:{response}"
+
+  def decode_response(self, message):
+    desc, payload = message.split(':')
+
+    if desc == 'draw_from':
+      assert payload in ['deck', 'discard']
+      return payload
+
+    elif desc == 'discard':
+      return self._decode_discard(payload)
+
+    elif desc == 'draw_discard':
+      return DrawAndDiscard(*self._decode_discard(payload))
+
+    else:
+      assert False, f"Unrecognized message description {desc}"
+
+  def _decode_discard(self, payload):
+    discard_choice, do_end = payload.split(';')
+    discard_choice = Card(discard_choice)
+    do_end = { 'True': True, 'False': False }[do_end]
+    return (discard_choice, do_end)
+
+  def tag(self, game, message):
+    """ The message, for the hand with id `game` """
+    return f"{game}|{message}"
+
+  def untag(self, message):
+    """ (game, message) for a tagged message, or (None, message) """
+    game, bar, rest = message.partition('|')
+    if not (bar and game.isdigit()):
+      return None, message
+    return int(game), rest
+
+# Header bytes: the kind of message in the low bits, and flags
+STARTING = 1
+OPPONENT_TURN = 2
+DRAWN = 3
+NEW_HAND = 4
+QUIT = 5
+DRAW_FROM = 6
+DISCARD = 7
+DRAW_DISCARD = 8
+TAGGED = 9
+KIND_BITS = 0x0f
+
+FROM_DISCARD = 0x10
+END = 0x20
+STARTS = 0x40
+
+class BinaryFormat:
+  """ Messages as bytes: a header byte and then a byte per card """
+
+  def encode_message(self, desc, *args):
+    if desc == 'starting':
+      hand, is_starting = args
+      return bytes([STARTING | (STARTS if is_starting else 0)] + [ card.index for card in hand ])
+
+    elif desc == 'opponent_turn':
+      (draw_location, discard_choice, do_end), = args
+      header = OPPONENT_TURN | (FROM_DISCARD if draw_location == 'discard' else 0) | (END if do_end else 0)
+      return bytes([header, discard_choice.index])
+
+    elif desc == 'drawn':
+      drawn_card, = args
+      return bytes([DRAWN, drawn_card.index])
+
+    elif desc == 'new_hand':
+      seed, = args
+      return bytes([NEW_HAND]) + (seed or '').encode()
+
+    elif desc == 'quit':
+      return bytes([QUIT])
+
+    else:
+      assert False, f"Unrecognized message description {desc}"
+
+  def decode_message(self, message):
+    header = message[0]
+    kind = header & KIND_BITS
+
+    if kind == STARTING:
+      return ('starting', { cards_by_index[index] for index in message[1:] }, bool(header & STARTS))
+
+    elif kind == OPPONENT_TURN:
+      draw_location = 'discard' if header & FROM_DISCARD else 'deck'
+      return ('opponent_turn', (draw_location, cards_by_index[message[1]], bool(header & END)))
+
+    elif kind == DRAWN:
+      return ('drawn', cards_by_index[message[1]])
+
+    elif kind == NEW_HAND:
+      return ('new_hand', message[1:].decode() or None)
+
+    elif kind == QUIT:
+      return ('quit',)
+
+    else:
+      assert False, f"Unrecognized message header {header}"
+
+  def encode_response(self, response):
+    if isinstance(response, DrawAndDiscard):
+      return bytes([DRAW_DISCARD | (END if response.do_end else 0), response.discard_choice.index])
+    elif isinstance(response, tuple):
+      discard_choice, do_end = response
+      return bytes([DISCARD | (END if do_end else 0), discard_choice.index])
+    else:
+      assert response in ['deck', 'discard']
+      return bytes([DRAW_FROM | (FROM_DISCARD if response == 'discard' else 0)])
+
+  def decode_response(self, message):
+    header = message[0]
+    kind = header & KIND_BITS
+
+    if kind == DRAW_FROM:
+      return 'discard' if header & FROM_DISCARD else 'deck'
+
+    elif kind == DISCARD:
+      return (cards_by_index[message[1]], bool(header & END))
+
+    elif kind == DRAW_DISCARD:
+      return DrawAndDiscard(cards_by_index[message[1]], bool(header & END))
+
+    else:
+      assert False, f"Unrecognized message header {header}"
+
+  def tag(self, game, message):
+    return struct.pack('>BI', TAGGED, game) + message
+
+  def untag(self, message):
+    if message[0] != TAGGED:
+      return None, message
+    _, game = struct.unpack_from('>BI', message)
+    return game, message[5:]
+
+TEXT = TextFormat()
+BINARY = BinaryFormat()